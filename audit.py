@@ -0,0 +1,102 @@
+# ============================ AUDIT ============================
+# Flusso JSONL di tutte le modifiche e degli esiti delle interazioni.
+# Le callback mettono l'evento in coda e tornano subito: la scrittura su
+# disco, la rotazione per dimensione e la compressione gzip avvengono in un
+# thread dedicato.
+import glob
+import gzip
+import heapq
+import itertools
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+AUDIT_DIR = os.environ.get("AUDIT_DIR", "audit")
+AUDIT_MAX_BYTES = int(os.environ.get("AUDIT_MAX_BYTES", 10 * 1024 * 1024))
+
+_STOP = object()
+
+
+class AuditLog:
+    def __init__(self, directory=AUDIT_DIR, tag="main", max_bytes=AUDIT_MAX_BYTES, queue_size=10000):
+        self.directory = directory
+        self.tag = tag
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="audit", daemon=True)
+        self._file = None
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"eventi-{self.tag}.jsonl")
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread.start()
+
+    def emit(self, kind, **fields):
+        record = {"ts": time.time(), "tipo": kind, **fields}
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Meglio perdere un evento di audit che bloccare una callback
+            self.dropped += 1
+
+    def close(self):
+        # Svuota la coda e chiude il file: da chiamare all'uscita del bot
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    # ---------------------------- THREAD SCRITTORE ----------------------------
+    def _run(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                break
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            # Flush solo quando la coda si svuota: a raffica si scrive a blocchi
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+            elif self._queue.empty():
+                self._file.flush()
+        self._file.close()
+
+    def _rotate(self):
+        self._file.close()
+        # Il nome ordinabile dei file ruotati mantiene l'ordine cronologico
+        now = time.time_ns()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now // 10**9)) + f"-{now % 10**9:09d}"
+        rotated = os.path.join(self.directory, f"eventi-{self.tag}.{stamp}")
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(rotated + ".jsonl.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+
+# ============================ LETTURA ============================
+def read_file(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def read_stream(directory=AUDIT_DIR):
+    # Ogni processo scrive il proprio file (file ruotati + file corrente):
+    # ciascun flusso è già in ordine, quindi basta un merge per timestamp
+    streams = []
+    for current in sorted(glob.glob(os.path.join(directory, "eventi-*.jsonl"))):
+        base = current[:-len(".jsonl")]
+        rotated = sorted(glob.glob(f"{glob.escape(base)}.*.jsonl.gz"))
+        streams.append(itertools.chain.from_iterable(read_file(p) for p in rotated + [current]))
+    return heapq.merge(*streams, key=lambda record: record["ts"])
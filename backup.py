@@ -0,0 +1,221 @@
+# ============================ BACKUP ============================
+# Snapshot compressi e con checksum dello store prenotazioni.
+# - "full": tutti gli eventi
+# - "delta": solo gli eventi cambiati dall'ultimo full, più l'elenco delle
+#   chiavi presenti per riconoscere gli eventi eliminati
+# Un ripristino richiede al massimo un full e un delta. La retention tiene
+# lo snapshot più recente di ogni ora/giorno/settimana e i full da cui
+# dipendono i delta conservati.
+#
+#   python backup.py crea
+#   python backup.py verifica
+#   python backup.py ripristina [nome] --db ripristino.db
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from store import BookingStore, DB_PATH
+
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "backup")
+KEEP_HOURLY = int(os.environ.get("BACKUP_KEEP_HOURLY", 24))
+KEEP_DAILY = int(os.environ.get("BACKUP_KEEP_DAILY", 7))
+KEEP_WEEKLY = int(os.environ.get("BACKUP_KEEP_WEEKLY", 4))
+# Oltre questa quota di eventi cambiati un delta non conviene più
+DELTA_MAX_RATIO = 0.5
+
+MANIFEST = "manifest.json"
+
+
+class BackupError(Exception):
+    pass
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BackupManager:
+    def __init__(self, store, directory=BACKUP_DIR,
+                 keep_hourly=KEEP_HOURLY, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY):
+        self.store = store
+        self.directory = directory
+        self.keep = {"%Y%m%d%H": keep_hourly, "%Y%m%d": keep_daily, "%G%V": keep_weekly}
+
+    # ---------------------------- MANIFEST ----------------------------
+    def _manifest_path(self):
+        return os.path.join(self.directory, MANIFEST)
+
+    def load_manifest(self):
+        try:
+            with open(self._manifest_path(), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _save_manifest(self, snapshots):
+        # Scrittura atomica: un crash lascia il manifest precedente intatto
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshots, f, indent=4)
+        os.replace(tmp, self._manifest_path())
+
+    # ---------------------------- CREAZIONE ----------------------------
+    def run_once(self):
+        # Restituisce lo snapshot creato, oppure None se nulla è cambiato
+        os.makedirs(self.directory, exist_ok=True)
+        snapshots = self.load_manifest()
+        last = snapshots[-1] if snapshots else None
+        if last and last["seq"] == self.store.seq():
+            return None
+
+        base = next((s for s in reversed(snapshots) if s["tipo"] == "full"), None)
+        seq, keys, changed, series = self.store.snapshot(base["seq"] if base else 0)
+        if base is None or len(changed) > len(keys) * DELTA_MAX_RATIO:
+            # Il delta sarebbe grande quanto un full: meglio un full nuovo
+            base = None
+            if len(changed) < len(keys):
+                seq, keys, changed, series = self.store.snapshot(0)
+
+        kind = "delta" if base else "full"
+        now = time.time()
+        name = f"snap-{time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))}-{seq}-{kind}.jsonl.gz"
+        path = os.path.join(self.directory, name)
+        # Le serie ricorrenti sono poche righe: sempre complete nell'intestazione
+        header = {"tipo": kind, "seq": seq, "base": base["nome"] if base else None, "serie": series}
+        if base:
+            header["chiavi"] = keys
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for event in changed:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        os.replace(tmp, path)
+
+        snapshot = {
+            "nome": name,
+            "tipo": kind,
+            "base": header["base"],
+            "seq": seq,
+            "eventi": len(changed),
+            "sha256": _sha256(path),
+            "creato": now,
+        }
+        snapshots.append(snapshot)
+        self._save_manifest(self._apply_retention(snapshots))
+        return snapshot
+
+    def _apply_retention(self, snapshots):
+        keep = set()
+        for fmt, count in self.keep.items():
+            buckets = []
+            for snap in reversed(snapshots):
+                bucket = time.strftime(fmt, time.gmtime(snap["creato"]))
+                if bucket in buckets:
+                    continue
+                if len(buckets) >= count:
+                    break
+                buckets.append(bucket)
+                keep.add(snap["nome"])
+        # L'ultimo snapshot resta sempre, e ogni delta conservato tiene il suo full
+        keep.add(snapshots[-1]["nome"])
+        keep |= {s["base"] for s in snapshots if s["nome"] in keep and s["base"]}
+
+        kept = []
+        for snap in snapshots:
+            if snap["nome"] in keep:
+                kept.append(snap)
+            else:
+                try:
+                    os.remove(os.path.join(self.directory, snap["nome"]))
+                except FileNotFoundError:
+                    pass
+        return kept
+
+    # ---------------------------- VERIFICA E RIPRISTINO ----------------------------
+    def _read(self, snap):
+        path = os.path.join(self.directory, snap["nome"])
+        if not os.path.exists(path):
+            raise BackupError(f"{snap['nome']}: file mancante")
+        if _sha256(path) != snap["sha256"]:
+            raise BackupError(f"{snap['nome']}: checksum non valido")
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            events = [json.loads(line) for line in f if line.strip()]
+        if header["seq"] != snap["seq"] or header["tipo"] != snap["tipo"]:
+            raise BackupError(f"{snap['nome']}: intestazione incoerente con il manifest")
+        return header, events
+
+    def verify(self):
+        errors = []
+        for snap in self.load_manifest():
+            try:
+                self._read(snap)
+            except (BackupError, OSError, ValueError) as e:
+                errors.append(str(e))
+        return errors
+
+    def load(self, name=None):
+        # Ricostruisce (seq, eventi, serie) di uno snapshot verificando i checksum
+        snapshots = {s["nome"]: s for s in self.load_manifest()}
+        if not snapshots:
+            raise BackupError("nessuno snapshot disponibile")
+        snap = snapshots.get(name) if name else list(snapshots.values())[-1]
+        if snap is None:
+            raise BackupError(f"snapshot {name} non trovato nel manifest")
+
+        header, events = self._read(snap)
+        if snap["tipo"] == "full":
+            return header["seq"], events, header.get("serie", [])
+
+        base = snapshots.get(snap["base"])
+        if base is None:
+            raise BackupError(f"{snap['nome']}: full di riferimento {snap['base']} mancante")
+        _, base_events = self._read(base)
+        merged = {e["data"]: e for e in base_events}
+        merged.update((e["data"], e) for e in events)
+        return header["seq"], [merged[k] for k in header["chiavi"] if k in merged], header.get("serie", [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup e ripristino dello store prenotazioni")
+    parser.add_argument("--dir", default=BACKUP_DIR)
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("crea", help="crea subito uno snapshot").add_argument("--db", default=DB_PATH)
+    sub.add_parser("verifica", help="controlla i checksum di tutti gli snapshot")
+    restore = sub.add_parser("ripristina", help="ricostruisce un database da uno snapshot")
+    restore.add_argument("nome", nargs="?", help="snapshot da ripristinare (default: il più recente)")
+    restore.add_argument("--db", required=True, help="database di destinazione, non deve esistere")
+    args = parser.parse_args()
+
+    if args.comando == "crea":
+        snap = BackupManager(BookingStore(args.db), args.dir).run_once()
+        print(f"Creato {snap['nome']}" if snap else "Nessuna modifica dall'ultimo snapshot")
+    elif args.comando == "verifica":
+        errors = BackupManager(None, args.dir).verify()
+        for error in errors:
+            print(f"❌ {error}")
+        if errors:
+            raise SystemExit(1)
+        print("✅ Tutti gli snapshot sono integri")
+    else:
+        if os.path.exists(args.db):
+            parser.error(f"{args.db} esiste già: scegli un file nuovo")
+        try:
+            seq, events, series = BackupManager(None, args.dir).load(args.nome)
+        except BackupError as e:
+            raise SystemExit(f"❌ {e}")
+        BookingStore(args.db).restore_snapshot(events, seq, series)
+        print(f"✅ Ripristinati {len(events)} eventi (seq {seq}) in {args.db}")
+
+
+if __name__ == "__main__":
+    main()
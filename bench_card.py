@@ -0,0 +1,80 @@
+# ============================ BENCHMARK CARD ============================
+# Tempo di rendering della card roster e tasso di hit della cache su una
+# sequenza di click realistica (prenota/rimuovi, anche a raffica).
+#
+#   python bench_card.py --sfondo BCO.png --click 300
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import card
+
+ROLES = ["Barcap", "Escort", "Sead", "Dead", "Strike"]
+
+
+def _background(path):
+    # Sfondo sintetico se non ne viene passato uno
+    card.Image.new("RGB", (1600, 900), (40, 60, 90)).save(path)
+    return path
+
+
+def bench_render(background, roles, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        card.render_card(background, "2026-01-01 21:00", "Benchmark", roles)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+async def bench_clicks(renderer, background, clicks, burst, seed):
+    rnd = random.Random(seed)
+    roles = {r: {"plane": rnd.choice(["F-16C", "FA-18C"]), "slots": 4, "users": []} for r in ROLES}
+    pilots = [f"pilota{i}" for i in range(12)]
+    done = 0
+    while done < clicks:
+        # Una raffica: più click quasi simultanei sullo stesso evento
+        tasks = []
+        for _ in range(min(rnd.randint(1, burst), clicks - done)):
+            info = roles[rnd.choice(ROLES)]
+            pilot = rnd.choice(pilots)
+            if pilot in info["users"]:
+                info["users"].remove(pilot)
+            elif len(info["users"]) < info["slots"] and not any(pilot in i["users"] for i in roles.values()):
+                info["users"].append(pilot)
+            tasks.append(renderer.render("evento", background, "2026-01-01 21:00", "Benchmark", roles))
+            done += 1
+        await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del rendering della card roster")
+    parser.add_argument("--sfondo", help="immagine di sfondo (default: sintetica 1600x900)")
+    parser.add_argument("--ripetizioni", type=int, default=20)
+    parser.add_argument("--click", type=int, default=300)
+    parser.add_argument("--raffica", type=int, default=5, help="click massimi per raffica")
+    args = parser.parse_args()
+    if not card.available():
+        raise SystemExit("Pillow non installato: pip install pillow")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        background = args.sfondo or _background(os.path.join(tmp, "sfondo.png"))
+        full = {r: {"plane": "F-16C", "slots": 4, "users": [f"p{r}{i}" for i in range(4)]} for r in ROLES}
+        timings = bench_render(background, full, args.ripetizioni)
+        print(f"Render: media {statistics.mean(timings):.1f}ms, "
+              f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:.1f}ms su {len(timings)} render")
+
+        renderer = card.CardRenderer(cache_dir=os.path.join(tmp, "cache"))
+        start = time.perf_counter()
+        asyncio.run(bench_clicks(renderer, background, args.click, args.raffica, seed=1))
+        elapsed = time.perf_counter() - start
+        print(f"Click: {args.click} in {elapsed:.2f}s — hit {renderer.hits}, miss {renderer.misses}, "
+              f"accorpati {renderer.coalesced}, hit rate {renderer.hit_rate() * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
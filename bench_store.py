@@ -0,0 +1,100 @@
+# ============================ BENCHMARK STORE ============================
+# Simula N processi shard che prenotano/rimuovono in parallelo sullo stesso
+# database e misura le interazioni al secondo (scrittura + rilettura embed).
+#
+# Limite: SQLite serializza le scritture, quindi con --cpu-ms 0 si misura solo
+# la contesa sul lock e il throughput NON cresce con i processi (può anzi
+# calare). Dividere gli shard serve a distribuire il lavoro fuori dal lock
+# (gateway, decodifica, embed, HTTP verso Discord): --cpu-ms simula quel
+# lavoro per interazione e mostra quanto scala finché la scrittura non
+# diventa il collo di bottiglia.
+#
+#   python bench_store.py --processi 1 2 4 8 --operazioni 2000
+#   python bench_store.py --processi 1 2 4 --operazioni 500 --cpu-ms 2
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from store import BookingStore
+
+ROLES = ["Barcap", "Escort", "Sead", "Dead", "Strike"]
+
+
+def _prepare(path, events):
+    store = BookingStore(path)
+    for i in range(events):
+        roles = {r: {"plane": "F-16C", "slots": 4, "users": []} for r in ROLES}
+        store.create_event(f"evento-{i}", "benchmark", roles)
+    store.close()
+
+
+def _busy(ms):
+    # Lavoro CPU per interazione svolto dal processo shard fuori dal lock
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+def _worker(path, worker_id, operations, events, cpu_ms, start_barrier):
+    store = BookingStore(path)
+    rnd = random.Random(worker_id)
+    start_barrier.wait()
+    for _ in range(operations):
+        if cpu_ms:
+            _busy(cpu_ms)
+        data = f"evento-{rnd.randrange(events)}"
+        esito, event = store.toggle_booking(data, rnd.choice(ROLES), f"pilota-{worker_id}-{rnd.randrange(20)}")
+        # Ogni slot mostrato deve rispettare il limite anche sotto contesa
+        for info in event["roles"].values():
+            assert len(info["users"]) <= info["slots"]
+        store.get_event(data)
+    store.close()
+
+
+def run(processes, operations, events, cpu_ms=0):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        _prepare(path, events)
+        barrier = multiprocessing.Barrier(processes + 1)
+        workers = [
+            multiprocessing.Process(target=_worker, args=(path, i, operations, events, cpu_ms, barrier))
+            for i in range(processes)
+        ]
+        for w in workers:
+            w.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        if any(w.exitcode for w in workers):
+            raise RuntimeError("un processo del benchmark è terminato con errore")
+    return processes * operations / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput dello store condiviso al variare dei processi")
+    parser.add_argument("--processi", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--operazioni", type=int, default=2000, help="interazioni per processo")
+    parser.add_argument("--eventi", type=int, default=50)
+    parser.add_argument("--cpu-ms", type=float, default=0,
+                        help="lavoro simulato per interazione fuori dal lock (gateway, embed)")
+    args = parser.parse_args()
+
+    if not args.cpu_ms:
+        print("Nota: senza --cpu-ms si misura solo la scrittura serializzata di SQLite, "
+              "che non scala con i processi.")
+    print(f"CPU disponibili: {os.cpu_count()} (oltre questo numero di processi non si può scalare)")
+    base = None
+    print(f"{'processi':>9} {'interazioni/s':>14} {'scala':>7}")
+    for n in args.processi:
+        rate = run(n, args.operazioni, args.eventi, args.cpu_ms)
+        base = base or rate
+        print(f"{n:>9} {rate:>14.0f} {rate / base:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
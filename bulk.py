@@ -0,0 +1,231 @@
+# ============================ IMPORT / EXPORT ============================
+# Import ed export in streaming di eventi e roster in CSV o JSONL.
+# L'import scrive a lotti (una transazione per lotto), l'export legge lo
+# store a pagine: nessuno dei due carica tutto lo storico in memoria.
+#
+# CSV: una riga per ruolo, colonne data,desc,ruolo,aereo,slot,piloti
+#      (piloti separati da ";"); le righe dello stesso evento sono consecutive.
+# JSONL: una riga per evento {"data", "desc", "roles": {ruolo: {plane, slots, users}}}
+#
+#   python bulk.py importa campagna.csv
+#   python bulk.py esporta archivio.jsonl
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+
+from config import NOT_ACTIVE
+from store import BookingStore, DB_PATH, EventExists
+
+FORMATS = ("csv", "jsonl")
+CSV_FIELDS = ["data", "desc", "ruolo", "aereo", "slot", "piloti"]
+BATCH_SIZE = 100
+
+
+class BulkError(ValueError):
+    # Eventi già salvati (lotti completati) quando l'import si è interrotto
+    imported = 0
+
+
+def detect_format(filename):
+    ext = os.path.splitext(filename)[1].lower().lstrip(".")
+    if ext not in FORMATS:
+        raise BulkError(f"formato non riconosciuto per {filename} (usa .csv o .jsonl)")
+    return ext
+
+
+# ---------------------------- LETTURA ----------------------------
+def _check_role(role, info, where, default_slots, planes):
+    if not isinstance(info, dict):
+        raise BulkError(f"{where}: il ruolo {role} deve essere un oggetto {{plane, slots, users}}")
+    info.setdefault("plane", NOT_ACTIVE)
+    info.setdefault("users", [])
+    try:
+        info["slots"] = int(info.get("slots") or default_slots)
+    except (TypeError, ValueError):
+        raise BulkError(f"{where}: slot non valido per {role}: {info.get('slots')!r}") from None
+    if not isinstance(info["plane"], str):
+        raise BulkError(f"{where}: aereo non valido per {role}")
+    if not isinstance(info["users"], list) or not all(isinstance(u, str) for u in info["users"]):
+        raise BulkError(f"{where}: i piloti di {role} devono essere una lista di nomi")
+    if planes is not None and info["plane"] not in planes and info["plane"] != NOT_ACTIVE:
+        raise BulkError(f"{where}: aereo sconosciuto {info['plane']} per {role}")
+    if len(info["users"]) > info["slots"]:
+        raise BulkError(f"{where}: {role} ha più piloti che slot")
+
+
+def _check_event(event, where, default_slots, planes):
+    if not event["data"]:
+        raise BulkError(f"{where}: data mancante")
+    if not event["roles"]:
+        raise BulkError(f"{where}: nessun ruolo per {event['data']}")
+    for role, info in event["roles"].items():
+        _check_role(role, info, where, default_slots, planes)
+    return event
+
+
+def _unique_keys(pairs):
+    # Un ruolo ripetuto nello stesso oggetto non deve sovrascrivere il primo
+    keys = [k for k, _ in pairs]
+    duplicates = sorted({k for k in keys if keys.count(k) > 1})
+    if duplicates:
+        raise ValueError(f"chiavi ripetute: {', '.join(duplicates)}")
+    return dict(pairs)
+
+
+def read_jsonl(f, default_slots, planes=None):
+    for lineno, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            raw = json.loads(line, object_pairs_hook=_unique_keys)
+            if not isinstance(raw, dict):
+                raise TypeError("ogni riga deve essere un oggetto JSON")
+            event = {"data": str(raw["data"]).strip(), "desc": str(raw.get("desc") or ""), "roles": raw["roles"]}
+            if not isinstance(event["roles"], dict):
+                raise TypeError("roles deve essere un oggetto")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise BulkError(f"riga {lineno}: {e}") from None
+        yield _check_event(event, f"riga {lineno}", default_slots, planes)
+
+
+def read_csv(f, default_slots, planes=None):
+    # Righe consecutive con la stessa data formano un evento. Il numero di
+    # riga si legge mentre si legge la riga stessa, così gli errori indicano
+    # la riga del file che li ha causati.
+    reader = csv.DictReader(f)
+    missing = {"data", "ruolo"} - set(reader.fieldnames or [])
+    if missing:
+        raise BulkError(f"colonne mancanti: {', '.join(sorted(missing))}")
+    event = None
+    for row in reader:
+        where = f"riga {reader.line_num}"
+        data = (row["data"] or "").strip()
+        if not data:
+            raise BulkError(f"{where}: data mancante")
+        role = (row["ruolo"] or "").strip()
+        if not role:
+            raise BulkError(f"{where}: ruolo mancante")
+        if event is None or event["data"] != data:
+            if event is not None:
+                yield event
+            event = {"data": data, "desc": "", "roles": {}}
+        if role in event["roles"]:
+            raise BulkError(f"{where}: ruolo {role} ripetuto per {data}")
+        event["desc"] = event["desc"] or (row.get("desc") or "").strip()
+        piloti = [p.strip() for p in (row.get("piloti") or "").split(";") if p.strip()]
+        info = {
+            "plane": (row.get("aereo") or "").strip() or NOT_ACTIVE,
+            "slots": row.get("slot"),
+            "users": piloti,
+        }
+        _check_role(role, info, where, default_slots, planes)
+        event["roles"][role] = info
+    if event is not None:
+        yield event
+
+
+def read_events(f, fmt, default_slots, planes=None):
+    reader = read_csv if fmt == "csv" else read_jsonl
+    try:
+        yield from reader(f, default_slots, planes)
+    except UnicodeDecodeError:
+        raise BulkError("il file non è codificato in UTF-8") from None
+    except csv.Error as e:
+        raise BulkError(f"CSV non valido: {e}") from None
+
+
+# ---------------------------- IMPORT ----------------------------
+def import_events(store, events, batch_size=BATCH_SIZE, on_batch=None, guild_id=None, channel_id=None):
+    total = 0
+    events = iter(events)
+    while True:
+        try:
+            batch = list(itertools.islice(events, batch_size))
+        except BulkError as e:
+            # I lotti precedenti sono già salvati: chi chiama lo deve sapere
+            e.imported = total
+            raise
+        if not batch:
+            return total
+        try:
+            total += store.put_events(batch, guild_id, channel_id)
+        except EventExists as e:
+            error = BulkError(f"l'evento {e} appartiene a un altro server")
+            error.imported = total
+            raise error from None
+        if on_batch:
+            on_batch(batch)
+
+
+# ---------------------------- EXPORT ----------------------------
+def export_events(store, f, fmt, guild_id=None):
+    # Con guild_id solo gli eventi di quella guild
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for event in store.iter_events(guild_id=guild_id):
+            for role, info in event["roles"].items():
+                writer.writerow({
+                    "data": event["data"],
+                    "desc": event["desc"],
+                    "ruolo": role,
+                    "aereo": info["plane"],
+                    "slot": info["slots"],
+                    "piloti": ";".join(info["users"]),
+                })
+            count += 1
+    else:
+        for event in store.iter_events(guild_id=guild_id):
+            f.write(json.dumps({"data": event["data"], "desc": event["desc"], "roles": event["roles"]},
+                               ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def import_bytes(store, payload, fmt, default_slots, planes=None, on_batch=None, guild_id=None, channel_id=None):
+    # Per gli allegati Discord, già scaricati in memoria
+    with io.TextIOWrapper(io.BytesIO(payload), encoding="utf-8-sig", newline="") as f:
+        events = read_events(f, fmt, default_slots, planes)
+        return import_events(store, events, on_batch=on_batch, guild_id=guild_id, channel_id=channel_id)
+
+
+def main():
+    from config import load_config
+
+    parser = argparse.ArgumentParser(description="Import/export in streaming di eventi e roster")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="comando", required=True)
+    imp = sub.add_parser("importa", help="importa eventi da CSV o JSONL")
+    imp.add_argument("file")
+    imp.add_argument("--lotto", type=int, default=BATCH_SIZE, help="eventi per transazione")
+    imp.add_argument("--guild", type=int, help="guild a cui assegnare gli eventi")
+    imp.add_argument("--canale", type=int, help="canale in cui il bot pubblicherà gli eventi (con --guild)")
+    exp = sub.add_parser("esporta", help="esporta tutti gli eventi in CSV o JSONL")
+    exp.add_argument("file")
+    exp.add_argument("--guild", type=int, help="solo gli eventi di questa guild")
+    args = parser.parse_args()
+
+    store = BookingStore(args.db)
+    try:
+        fmt = detect_format(args.file)
+        if args.comando == "importa":
+            defaults = load_config().default
+            with open(args.file, "r", encoding="utf-8-sig", newline="") as f:
+                events = read_events(f, fmt, defaults.default_slots, defaults.planes)
+                count = import_events(store, events, args.lotto, guild_id=args.guild,
+                                      channel_id=args.canale if args.guild else None)
+            print(f"✅ Importati {count} eventi da {args.file}")
+        else:
+            with open(args.file, "w", encoding="utf-8", newline="") as f:
+                count = export_events(store, f, fmt, args.guild)
+            print(f"✅ Esportati {count} eventi in {args.file}")
+    except BulkError as e:
+        raise SystemExit(f"❌ {e} ({e.imported} eventi già importati)" if e.imported else f"❌ {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# ============================ CARD ROSTER ============================
+# Immagine della missione con il roster disegnato sopra lo sfondo dello
+# squadrone. Facoltativa: richiede Pillow, altrimenti il bot usa il solo embed.
+# Il rendering gira in un pool di thread; il risultato è indicizzato
+# dall'hash dello stato dell'evento (cache in memoria + su disco), quindi
+# un roster già visto non viene ridisegnato. Durante le raffiche di click
+# si disegna solo l'ultimo stato arrivato e tutti ricevono quello.
+import asyncio
+import hashlib
+import io
+import itertools
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import NOT_ACTIVE
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+CARD_CACHE_DIR = os.environ.get("CARD_CACHE_DIR", "card_cache")
+CARD_CACHE_MAX_BYTES = int(os.environ.get("CARD_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+CARD_FILENAME = "roster.png"
+CARD_WIDTH = 1024
+# Da incrementare quando cambia il disegno: invalida la cache su disco
+RENDER_VERSION = 1
+
+
+def available():
+    return Image is not None
+
+
+def _font(size):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def state_digest(background_digest, data, desc, roles):
+    state = json.dumps([RENDER_VERSION, background_digest, data, desc, roles], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(state.encode("utf-8")).hexdigest()
+
+
+def render_card(background_path, data, desc, roles):
+    with Image.open(background_path) as bg:
+        bg = bg.convert("RGBA")
+        height = max(1, round(bg.height * CARD_WIDTH / bg.width))
+        card = bg.resize((CARD_WIDTH, height))
+
+    title_font, text_font, small_font = _font(40), _font(26), _font(20)
+    line_height = 34 + 26
+    panel_height = 130 + line_height * len(roles)
+    if panel_height > card.height:
+        # Roster più alto dello sfondo: si allunga la card ripetendo lo sfondo
+        tall = Image.new("RGBA", (CARD_WIDTH, panel_height))
+        for y in range(0, panel_height, card.height):
+            tall.paste(card, (0, y))
+        card = tall
+
+    overlay = Image.new("RGBA", card.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    draw.rectangle((24, 24, CARD_WIDTH - 24, panel_height - 8), fill=(10, 20, 30, 180))
+    draw.text((48, 40), f"Missione: {data}", font=title_font, fill=(255, 255, 255, 255))
+    draw.text((48, 90), desc, font=small_font, fill=(200, 210, 220, 255))
+
+    y = 130
+    for role, info in roles.items():
+        active = info["plane"] != NOT_ACTIVE
+        color = (26, 188, 156, 255) if active else (150, 150, 150, 255)
+        draw.text((48, y), f"{role}  {len(info['users'])}/{info['slots']}  —  {info['plane']}",
+                  font=text_font, fill=color)
+        pilots = ", ".join(info["users"]) if info["users"] else "Nessuno"
+        draw.text((72, y + 32), pilots, font=small_font, fill=(230, 230, 230, 255))
+        y += line_height
+
+    out = io.BytesIO()
+    Image.alpha_composite(card, overlay).convert("RGB").save(out, format="PNG", optimize=False)
+    return out.getvalue()
+
+
+class CardRenderer:
+    def __init__(self, cache_dir=CARD_CACHE_DIR, workers=2, memory_items=64, max_bytes=CARD_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="card")
+        self._memory = OrderedDict()
+        self._backgrounds = {}
+        # Per evento: task che disegna, ultimo stato richiesto e chi lo attende
+        self._workers = {}
+        self._latest = {}
+        self._waiters = {}
+        self._order = itertools.count()
+        os.makedirs(cache_dir, exist_ok=True)
+        # Occupazione su disco delle card, aggiornata dai thread del pool
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    # ---------------------------- CACHE ----------------------------
+    def _remember(self, digest, png):
+        self._memory[digest] = png
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _disk_entries(self):
+        # (mtime, dimensione, percorso) delle card; gli sfondi scaricati restano
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".png") and not entry.name.startswith("sfondo-"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _prune_disk(self):
+        # Oltre il budget si eliminano le card usate meno di recente fino
+        # al 90% del limite, così la scansione non si ripete a ogni render
+        with self._disk_lock:
+            if self._disk_bytes <= self.max_bytes:
+                return
+            entries = sorted(self._disk_entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._disk_bytes = total
+
+    def _read_disk(self, digest):
+        path = os.path.join(self.cache_dir, f"{digest}.png")
+        try:
+            with open(path, "rb") as f:
+                png = f.read()
+        except FileNotFoundError:
+            return None
+        # mtime come ultimo uso: la pulizia tiene le card lette di recente
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return png
+
+    async def _lookup(self, digest):
+        # La cache in memoria si tocca solo dal loop, il disco dal pool
+        png = self._memory.get(digest)
+        if png is not None:
+            self._memory.move_to_end(digest)
+            return png
+        png = await asyncio.get_running_loop().run_in_executor(self._executor, self._read_disk, digest)
+        if png is not None:
+            self._remember(digest, png)
+        return png
+
+    def _render_and_store(self, background_path, digest, data, desc, roles):
+        png = render_card(background_path, data, desc, roles)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(png)
+        os.replace(tmp, os.path.join(self.cache_dir, f"{digest}.png"))
+        with self._disk_lock:
+            self._disk_bytes += len(png)
+        self._prune_disk()
+        return png
+
+    def background_digest(self, background_path):
+        # L'hash dello sfondo entra nella chiave: cambiare immagine invalida le card
+        mtime = os.stat(background_path).st_mtime
+        cached = self._backgrounds.get(background_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, file_digest(background_path))
+            self._backgrounds[background_path] = cached
+        return cached[1]
+
+    # ---------------------------- RENDER ----------------------------
+    async def render(self, key, background_path, data, desc, roles):
+        # key identifica l'evento. Restituisce (data, desc, roles, png): se
+        # nel frattempo è arrivato uno stato più recente per lo stesso evento
+        # si ricevono quello e la sua immagine, da usare anche per l'embed.
+        order = next(self._order)
+        loop = asyncio.get_running_loop()
+        roles = json.loads(json.dumps(roles))
+        background = await loop.run_in_executor(self._executor, self.background_digest, background_path)
+        digest = state_digest(background, data, desc, roles)
+        request = (order, (background_path, digest, data, desc, roles))
+
+        if key not in self._workers:
+            png = await self._lookup(digest)
+            if png is not None and key not in self._workers:
+                self.hits += 1
+                return data, desc, roles, png
+
+        # Le richieste possono superarsi durante gli await: vale l'ordine d'arrivo
+        if key not in self._latest or self._latest[key][0] < order:
+            self._latest[key] = request
+        future = loop.create_future()
+        self._waiters.setdefault(key, []).append(future)
+        if key in self._workers:
+            self.coalesced += 1
+        else:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+        return await future
+
+    async def _drain(self, key):
+        # Task separato da chi ha chiesto il render: disegna l'ultimo stato
+        # richiesto finché non ne arrivano di nuovi, poi risponde a tutti
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                order, args = self._latest[key]
+                png = await self._lookup(args[1])
+                if png is None:
+                    self.misses += 1
+                    png = await loop.run_in_executor(self._executor, self._render_and_store, *args)
+                    self._remember(args[1], png)
+                else:
+                    self.hits += 1
+                if self._latest[key][0] == order:
+                    break
+            result = (args[2], args[3], args[4], png)
+            for future in self._waiters.pop(key):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for future in self._waiters.pop(key, []):
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._latest.pop(key, None)
+            self._waiters.pop(key, None)
+            self._workers.pop(key, None)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
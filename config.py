@@ -0,0 +1,94 @@
+# ============================ CONFIGURAZIONE ============================
+# Configurazione per guild letta da config.json. Ogni caricamento produce un
+# oggetto immutabile con le SelectOption degli aerei già costruite, così le
+# view non le ricreano a ogni apertura e il file può essere ricaricato a caldo.
+import json
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import discord
+
+CONFIG_PATH = os.environ.get("BOT_CONFIG", "config.json")
+NOT_ACTIVE = "Non Attivo"
+
+_DEFAULTS = {
+    "background_url": "",
+    "max_roles": 5,
+    "default_slots": 4,
+    "planes": [],
+    "setup_ttl": 900,
+    "max_setup_sessions": 2,
+    "booking_window_days": 7,
+    "roster_card": False,
+}
+
+
+@dataclass(frozen=True)
+class GuildConfig:
+    guild_id: int
+    background_url: str
+    max_roles: int
+    default_slots: int
+    planes: tuple
+    plane_options: tuple
+    setup_ttl: int
+    max_setup_sessions: int
+    booking_window_days: int
+    roster_card: bool
+
+
+@dataclass(frozen=True)
+class Config:
+    default: GuildConfig
+    guilds: MappingProxyType
+    mtime: float
+
+    @property
+    def guild_ids(self):
+        return tuple(self.guilds)
+
+    def for_guild(self, guild_id):
+        return self.guilds.get(guild_id, self.default)
+
+
+def _build_guild(guild_id, raw):
+    planes = tuple(str(p) for p in raw["planes"])
+    if not planes:
+        raise ValueError(f"nessun aereo configurato per la guild {guild_id}")
+    max_roles = int(raw["max_roles"])
+    default_slots = int(raw["default_slots"])
+    setup_ttl = int(raw["setup_ttl"])
+    max_setup_sessions = int(raw["max_setup_sessions"])
+    booking_window_days = int(raw["booking_window_days"])
+    if min(max_roles, default_slots, setup_ttl, max_setup_sessions, booking_window_days) < 1:
+        raise ValueError(f"limiti e durate devono essere positivi (guild {guild_id})")
+    options = tuple(discord.SelectOption(label=p, value=p) for p in planes + (NOT_ACTIVE,))
+    return GuildConfig(
+        guild_id=guild_id,
+        background_url=str(raw["background_url"]),
+        max_roles=max_roles,
+        default_slots=default_slots,
+        planes=planes,
+        plane_options=options,
+        setup_ttl=setup_ttl,
+        max_setup_sessions=max_setup_sessions,
+        booking_window_days=booking_window_days,
+        roster_card=bool(raw["roster_card"]),
+    )
+
+
+def load_config(path=CONFIG_PATH):
+    mtime = os.stat(path).st_mtime
+    with open(path, "r") as f:
+        raw = json.load(f)
+
+    base = {**_DEFAULTS, **raw.get("default", {})}
+    guilds = {}
+    for guild_id, override in raw.get("guilds", {}).items():
+        guilds[int(guild_id)] = _build_guild(int(guild_id), {**base, **(override or {})})
+    return Config(
+        default=_build_guild(None, base),
+        guilds=MappingProxyType(guilds),
+        mtime=mtime,
+    )
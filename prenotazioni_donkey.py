@@ -1,49 +1,96 @@
 # ============================ CONFIG ============================
 import discord
 from discord import app_commands
-from discord.ext import commands
-import json
+from discord.ext import commands, tasks
+import aiohttp
+import asyncio
+import concurrent.futures
+import hashlib
+import hmac
+import io
 import os
-from flask import Flask
+import re
+import sqlite3
+import tempfile
+import time
+from datetime import date, datetime
+from flask import Flask, abort, request, send_file
 from threading import Thread
 
+from audit import AuditLog
+from backup import BackupManager
+from bulk import FORMATS, BulkError, detect_format, export_events, import_bytes
+from card import CARD_CACHE_DIR, CARD_FILENAME, CardRenderer, available as card_available
+from config import CONFIG_PATH, NOT_ACTIVE, load_config
+from profiling import MODES, ProfilingBusy, run_profile
+from roster_api import create_roster_api
+from store import BookingStore, DB_PATH, EventExists, LEGACY_JSON, parse_mission_date
+
 TOKEN = os.environ.get("DISCORD_TOKEN")
 if not TOKEN:
     raise RuntimeError("DISCORD_TOKEN non trovato — imposta la variabile d'ambiente")
 
-GUILD_IDS = [
-    1358713154116259892,  # tuo server principale
-    687741871757197312    # altro server
-]
+# Guild, aerei, slot e limiti stanno in config.json (ricaricato a caldo)
+config = load_config(CONFIG_PATH)
+
+# Intervallo degli snapshot di backup dello store (minuti)
+BACKUP_INTERVAL = int(os.environ.get("BACKUP_INTERVAL", 60))
 
-BACKGROUND_URL = "https://cdn.discordapp.com/attachments/710523786558046298/1403090934857728001/BCO.png"
-MAX_ROLES = 5
-DEFAULT_SLOTS = 4
+# Token per l'endpoint HTTP di profiling; se assente l'endpoint è disattivato
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+
+# Modalità multi-processo: ogni processo gestisce un sottoinsieme di shard
+# (es. SHARD_COUNT=4 SHARD_IDS=0,1 e SHARD_COUNT=4 SHARD_IDS=2,3) e tutti
+# condividono lo stesso database BOOKINGS_DB
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None
+SHARD_IDS = [int(s) for s in os.environ["SHARD_IDS"].split(",")] if os.environ.get("SHARD_IDS") else None
+# Il web server (/, /metrics, /api, /debug/profilo) gira solo nel processo
+# con lo shard 0, come i backup: gli altri processi non aprono PORT.
+# /api legge lo store condiviso; /metrics e /debug/profilo riguardano il
+# solo processo dello shard 0.
+WEB_SERVER = not SHARD_IDS or 0 in SHARD_IDS
 
 # ============================ BOT ============================
+STARTED_AT = time.monotonic()
+
 intents = discord.Intents.default()
-bot = commands.Bot(command_prefix="!", intents=intents)
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix="!", intents=intents,
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
 
 # ============================ PERSISTENZA ============================
-if os.path.exists("prenotazioni.json"):
-    with open("prenotazioni.json", "r") as f:
-        bookings = json.load(f)
-else:
-    bookings = {}
+store = BookingStore(DB_PATH)
+store.import_legacy(LEGACY_JSON)
+
+# Un file di audit per processo, così gli shard non si contendono lo stesso file
+audit = AuditLog(tag="-".join(map(str, SHARD_IDS)) if SHARD_IDS else "main")
+audit.start()
 
-def save_bookings():
-    with open("prenotazioni.json", "w") as f:
-        json.dump(bookings, f, indent=4)
+# Con più processi solo quello che gestisce lo shard 0 esegue i backup
+backups = BackupManager(store) if not SHARD_IDS or 0 in SHARD_IDS else None
+
+@tasks.loop(minutes=BACKUP_INTERVAL)
+async def backup_store():
+    # Compressione e checksum girano in un thread, mai sul loop del bot
+    try:
+        snapshot = await asyncio.to_thread(backups.run_once)
+    except Exception as e:
+        print(f"Errore backup: {e}")
+        return
+    if snapshot:
+        print(f"💾 Backup {snapshot['tipo']} {snapshot['nome']} ({snapshot['eventi']} eventi)")
 
 # ============================ FUNZIONE EMBED ============================
-def generate_embed(data: str, desc: str, active_roles: dict):
+def generate_embed(data: str, desc: str, active_roles: dict, guild_id=None):
     embed = discord.Embed(
         title="📋 Prenotazioni Piloti",
         description=f"📅 Missione: {data}\n📝 {desc}",
         color=0x1abc9c
     )
     for role, info in active_roles.items():
-        stato = "✅ Attivo" if info["plane"] != "Non Attivo" else "❌ Non Attivo"
+        stato = "✅ Attivo" if info["plane"] != NOT_ACTIVE else "❌ Non Attivo"
         piloti = ", ".join(info["users"]) if info["users"] else "Nessuno"
         embed.add_field(
             name=f"{role} ({len(info['users'])}/{info['slots']}) - {stato} - {info['plane']}",
@@ -51,15 +98,74 @@ def generate_embed(data: str, desc: str, active_roles: dict):
             inline=False
         )
     embed.set_footer(text="Prenota cliccando i pulsanti qui sotto ✈️")
-    embed.set_image(url=BACKGROUND_URL)
+    embed.set_image(url=config.for_guild(guild_id).background_url)
     return embed
 
+# ============================ CARD ROSTER ============================
+# Con roster_card attivo nella config della guild l'immagine dell'embed è
+# una card generata localmente (richiede Pillow); in caso di errore si
+# torna all'embed con lo sfondo statico
+card_renderer = CardRenderer() if card_available() else None
+background_locks = {}
+
+def card_enabled(guild_id):
+    return card_renderer is not None and config.for_guild(guild_id).roster_card
+
+async def local_background(url):
+    # Copia locale dello sfondo, scaricata una sola volta per URL
+    name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(CARD_CACHE_DIR, f"sfondo-{name}")
+    async with background_locks.setdefault(path, asyncio.Lock()):
+        if not os.path.exists(path):
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    payload = await response.read()
+
+            def write():
+                with open(path + ".tmp", "wb") as f:
+                    f.write(payload)
+                os.replace(path + ".tmp", path)
+
+            await asyncio.to_thread(write)
+    return path
+
+async def build_message(data: str, desc: str, active_roles: dict, guild_id=None):
+    # Restituisce (embed, allegati) da passare a send/edit
+    if not card_enabled(guild_id):
+        return generate_embed(data, desc, active_roles, guild_id), []
+    try:
+        background = await local_background(config.for_guild(guild_id).background_url)
+        # Durante una raffica di click il renderer restituisce l'ultimo stato
+        # dell'evento: testo e immagine dell'embed vengono da quello
+        data, desc, active_roles, png = await card_renderer.render(data, background, data, desc, active_roles)
+    except Exception as e:
+        print(f"Errore card roster {data}: {e}")
+        return generate_embed(data, desc, active_roles, guild_id), []
+    embed = generate_embed(data, desc, active_roles, guild_id)
+    embed.set_image(url=f"attachment://{CARD_FILENAME}")
+    return embed, [discord.File(io.BytesIO(png), filename=CARD_FILENAME)]
+
+async def update_booking_message(interaction: discord.Interaction, data, desc, active_roles, view):
+    # La card può richiedere il download dello sfondo e l'attesa nel pool di
+    # rendering: l'interazione si conferma subito (Discord concede 3 secondi)
+    # e il messaggio si modifica appena l'immagine è pronta
+    if card_enabled(interaction.guild_id):
+        await interaction.response.defer()
+        embed, files = await build_message(data, desc, active_roles, interaction.guild_id)
+        await interaction.edit_original_response(embed=embed, attachments=files, view=view)
+        return
+    embed, files = await build_message(data, desc, active_roles, interaction.guild_id)
+    await interaction.response.edit_message(embed=embed, attachments=files, view=view)
+
 # ============================ BOTTONI PRENOTAZIONE ============================
 class BookingButton(discord.ui.Button):
-    def __init__(self, role, data, desc, active_roles, plane):
+    def __init__(self, role, data, desc, active_roles, plane, event_id, index):
         is_active = active_roles[role]["plane"] == plane
         color = discord.ButtonStyle.success if is_active else discord.ButtonStyle.secondary
-        super().__init__(label=role, style=color, disabled=not is_active)
+        # custom_id stabile: la view sopravvive ai riavvii del bot
+        super().__init__(label=role, style=color, disabled=not is_active,
+                         custom_id=f"prenota:{event_id}:{index}:{plane}"[:100])
         self.role_name = role
         self.data = data
         self.desc = desc
@@ -68,99 +174,115 @@ class BookingButton(discord.ui.Button):
 
     async def callback(self, interaction: discord.Interaction):
         user = interaction.user.name
-        already_in_role = None
-        for r, info in self.active_roles.items():
-            if user in info["users"]:
-                already_in_role = r
-                break
-
-        if already_in_role and already_in_role != self.role_name:
+        # Lettura e scrittura nella stessa transazione: gli slot mostrati
+        # nell'embed sono quelli effettivi anche con più processi attivi
+        esito, event = await asyncio.to_thread(store.toggle_booking, self.data, self.role_name, user)
+        audit.emit("prenotazione", esito=esito, data=self.data, ruolo=self.role_name,
+                   utente=user, user_id=interaction.user.id, guild_id=interaction.guild_id)
+        if event is None or esito == "sconosciuto":
             await interaction.response.send_message(
-                f"⚠️ Sei già prenotato in **{already_in_role}**! "
-                "Rimuoviti prima da quel ruolo per prenotarti qui.",
+                "⚠️ Questo evento non esiste più.",
                 ephemeral=True
             )
             return
 
-        role_info = self.active_roles[self.role_name]
+        self.active_roles.clear()
+        self.active_roles.update(event["roles"])
 
-        if user in role_info["users"]:
-            role_info["users"].remove(user)
-            save_bookings()
-            embed = generate_embed(self.data, self.desc, self.active_roles)
-            await interaction.response.edit_message(embed=embed, view=self.view)
-            await interaction.followup.send(
-                f"❌ Hai rimosso la tua prenotazione da **{self.role_name}**.",
+        if esito == "occupato":
+            already_in_role = next(r for r, info in self.active_roles.items() if user in info["users"])
+            await interaction.response.send_message(
+                f"⚠️ Sei già prenotato in **{already_in_role}**! "
+                "Rimuoviti prima da quel ruolo per prenotarti qui.",
                 ephemeral=True
             )
             return
 
-        if len(role_info["users"]) >= role_info["slots"]:
+        if esito == "pieno":
             await interaction.response.send_message(
                 f"⚠️ {self.role_name} è già pieno!",
                 ephemeral=True
             )
             return
 
-        role_info["users"].append(user)
-        save_bookings()
-        embed = generate_embed(self.data, self.desc, self.active_roles)
-        await interaction.response.edit_message(embed=embed, view=self.view)
-        await interaction.followup.send(
-            f"✅ Prenotazione in **{self.role_name}** confermata!",
-            ephemeral=True
-        )
+        await update_booking_message(interaction, self.data, self.desc, self.active_roles, self.view)
+        if esito == "rimosso":
+            await interaction.followup.send(
+                f"❌ Hai rimosso la tua prenotazione da **{self.role_name}**.",
+                ephemeral=True
+            )
+        else:
+            await interaction.followup.send(
+                f"✅ Prenotazione in **{self.role_name}** confermata!",
+                ephemeral=True
+            )
 
 class ChangePlaneButton(discord.ui.Button):
-    def __init__(self, data, desc, active_roles):
-        super().__init__(label="Cambia Aereo", style=discord.ButtonStyle.secondary)
+    def __init__(self, data, desc, active_roles, event_id):
+        super().__init__(label="Cambia Aereo", style=discord.ButtonStyle.secondary,
+                         custom_id=f"prenota:{event_id}:cambia")
         self.data = data
         self.desc = desc
         self.active_roles = active_roles
+        self.event_id = event_id
 
     async def callback(self, interaction: discord.Interaction):
-        view = PlaneSelectView(self.data, self.desc, self.active_roles)
-        embed = generate_embed(self.data, self.desc, self.active_roles)
-        await interaction.response.edit_message(embed=embed, view=view)
+        await refresh_roles(self.data, self.active_roles)
+        view = PlaneSelectView(self.data, self.desc, self.active_roles, self.event_id)
+        await update_booking_message(interaction, self.data, self.desc, self.active_roles, view)
 
 # ============================ VIEW PRENOTAZIONE ============================
 class BookingView(discord.ui.View):
-    def __init__(self, data, desc, active_roles, plane):
+    def __init__(self, data, desc, active_roles, plane, event_id):
         super().__init__(timeout=None)
-        for role in active_roles:
-            self.add_item(BookingButton(role, data, desc, active_roles, plane))
-        self.add_item(ChangePlaneButton(data, desc, active_roles))
+        for index, role in enumerate(active_roles):
+            self.add_item(BookingButton(role, data, desc, active_roles, plane, event_id, index))
+        self.add_item(ChangePlaneButton(data, desc, active_roles, event_id))
+
+def active_planes(active_roles):
+    return sorted({info["plane"] for info in active_roles.values() if info["plane"] != NOT_ACTIVE})
+
+async def refresh_roles(data, active_roles):
+    # Un altro processo (o un riavvio) può aver cambiato il roster
+    event = await asyncio.to_thread(store.get_event, data)
+    if event:
+        active_roles.clear()
+        active_roles.update(event["roles"])
 
 class PlaneSelect(discord.ui.Select):
-    def __init__(self, data, desc, active_roles):
-        planes = list({info["plane"] for info in active_roles.values() if info["plane"] != "Non Attivo"})
-        options = [discord.SelectOption(label=p, value=p) for p in planes]
-        super().__init__(placeholder="Seleziona l'aereo con cui vuoi volare", min_values=1, max_values=1, options=options)
+    def __init__(self, data, desc, active_roles, event_id):
+        options = [discord.SelectOption(label=p, value=p) for p in active_planes(active_roles)]
+        super().__init__(placeholder="Seleziona l'aereo con cui vuoi volare", min_values=1, max_values=1,
+                         options=options, custom_id=f"prenota:{event_id}:aereo")
         self.data = data
         self.desc = desc
         self.active_roles = active_roles
+        self.event_id = event_id
 
     async def callback(self, interaction: discord.Interaction):
         chosen_plane = self.values[0]
-        embed = generate_embed(self.data, self.desc, self.active_roles)
-        view = BookingView(self.data, self.desc, self.active_roles, chosen_plane)
-        await interaction.response.edit_message(embed=embed, view=view)
+        audit.emit("scelta_aereo", data=self.data, aereo=chosen_plane,
+                   utente=interaction.user.name, user_id=interaction.user.id, guild_id=interaction.guild_id)
+        await refresh_roles(self.data, self.active_roles)
+        view = BookingView(self.data, self.desc, self.active_roles, chosen_plane, self.event_id)
+        await update_booking_message(interaction, self.data, self.desc, self.active_roles, view)
 
 class PlaneSelectView(discord.ui.View):
-    def __init__(self, data, desc, active_roles):
-        super().__init__()
-        self.add_item(PlaneSelect(data, desc, active_roles))
+    def __init__(self, data, desc, active_roles, event_id):
+        super().__init__(timeout=None)
+        self.add_item(PlaneSelect(data, desc, active_roles, event_id))
 
 # ============================ MODAL E SELEZIONE RUOLI ============================
 class RoleInput(discord.ui.Modal, title="Aggiungi Ruolo"):
     role_name = discord.ui.TextInput(label="Nome ruolo", placeholder="Scrivi il nome del ruolo", max_length=50)
 
     def __init__(self, parent_view):
-        super().__init__()
+        super().__init__(timeout=parent_view.cfg.setup_ttl)
         self.parent_view = parent_view
+        parent_view.track(self)
 
     async def on_submit(self, interaction: discord.Interaction):
-        if len(self.parent_view.roles) >= MAX_ROLES:
+        if len(self.parent_view.roles) >= self.parent_view.cfg.max_roles:
             await interaction.response.send_message("Hai raggiunto il limite di ruoli.", ephemeral=True)
             return
 
@@ -176,13 +298,8 @@ class RoleInput(discord.ui.Modal, title="Aggiungi Ruolo"):
 
 class PlaneSelectForRole(discord.ui.Select):
     def __init__(self, parent_view, role_name):
-        options = [
-            discord.SelectOption(label="F-16C", value="F-16C"),
-            discord.SelectOption(label="FA-18C", value="FA-18C"),
-            discord.SelectOption(label="Non Attivo", value="Non Attivo")
-        ]
         super().__init__(placeholder=f"Scegli aereo per {role_name}",
-                         min_values=1, max_values=1, options=options)
+                         min_values=1, max_values=1, options=list(parent_view.cfg.plane_options))
         self.parent_view = parent_view
         self.role_name = role_name
 
@@ -192,7 +309,7 @@ class PlaneSelectForRole(discord.ui.Select):
             f"Aereo per ruolo **{self.role_name}** impostato su **{self.values[0]}**",
             ephemeral=True
         )
-        if len(self.parent_view.roles) < MAX_ROLES:
+        if len(self.parent_view.roles) < self.parent_view.cfg.max_roles:
             await interaction.followup.send(
                 "Vuoi aggiungere un nuovo ruolo?",
                 view=AddRoleButtonView(self.parent_view),
@@ -208,7 +325,7 @@ class SetPlaneButton(discord.ui.Button):
         self.role_name = role_name
 
     async def callback(self, interaction: discord.Interaction):
-        view = discord.ui.View()
+        view = self.parent_view.track(discord.ui.View(timeout=self.parent_view.cfg.setup_ttl))
         view.add_item(PlaneSelectForRole(self.parent_view, self.role_name))
         await interaction.response.send_message(
             f"Seleziona l'aereo per il ruolo **{self.role_name}**:",
@@ -218,7 +335,8 @@ class SetPlaneButton(discord.ui.Button):
 
 class SetPlaneButtonView(discord.ui.View):
     def __init__(self, parent_view, role_name):
-        super().__init__(timeout=None)
+        super().__init__(timeout=parent_view.cfg.setup_ttl)
+        parent_view.track(self)
         self.add_item(SetPlaneButton(parent_view, role_name))
 
 class AddRoleButton(discord.ui.Button):
@@ -241,35 +359,153 @@ class ConfirmEventButton(discord.ui.Button):
 
 class AddRoleButtonView(discord.ui.View):
     def __init__(self, parent_view):
-        super().__init__(timeout=None)
+        super().__init__(timeout=parent_view.cfg.setup_ttl)
+        parent_view.track(self)
         self.add_item(AddRoleButton(parent_view))
         self.add_item(ConfirmEventButton(parent_view))
 
 # ============================ EVENT SETUP ============================
 class EventSetupView:
-    def __init__(self, data, desc):
+    def __init__(self, data, desc, cfg, guild_id, user_id, series=None):
         self.data = data
         self.desc = desc
+        # Con una serie il wizard definisce il layout ricorrente, non un evento
+        self.series = series
+        # Configurazione fissata all'avvio del wizard: un reload a metà
+        # procedura non cambia aerei o limiti già mostrati
+        self.cfg = cfg
+        self.key = (guild_id, user_id)
         self.roles = []
         self.selected_planes = {}
+        # View e modal aperti da questo wizard, fermati a fine procedura
+        self.views = []
+        self.last_activity = time.monotonic()
+        self.closed = False
+
+    def track(self, view):
+        self.views.append(view)
+        self.last_activity = time.monotonic()
+        return view
+
+    def expired(self, now):
+        return now - self.last_activity > self.cfg.setup_ttl
+
+    def close(self):
+        self.closed = True
+        for view in self.views:
+            view.stop()
+        self.views.clear()
 
     async def start(self, interaction: discord.Interaction):
         await interaction.response.send_modal(RoleInput(self))
 
     async def finish_setup(self, interaction: discord.Interaction):
+        # Doppio click su "Conferma Evento" o wizard già scaduto
+        if self.closed:
+            await interaction.followup.send("⚠️ Questa procedura è già conclusa o scaduta.", ephemeral=True)
+            return
+        setup_sessions.close(self)
+
         active_roles = {}
         for role in self.roles:
-            plane_choice = self.selected_planes.get(role, "Non Attivo")
+            plane_choice = self.selected_planes.get(role, NOT_ACTIVE)
             active_roles[role] = {
                 "plane": plane_choice,
-                "slots": DEFAULT_SLOTS,
+                "slots": self.cfg.default_slots,
                 "users": []
             }
-        bookings[self.data] = active_roles
-        save_bookings()
-        plane_view = PlaneSelectView(self.data, self.desc, active_roles)
-        embed = generate_embed(self.data, self.desc, active_roles)
-        await interaction.followup.send(embed=embed, view=plane_view)
+        if self.series is not None:
+            await self.save_series(interaction, active_roles)
+            return
+        try:
+            event = await asyncio.to_thread(store.create_event, self.data, self.desc, active_roles,
+                                            interaction.guild_id, True)
+        except EventExists:
+            await interaction.followup.send(
+                f"⚠️ Esiste già un evento **{self.data}**: usa una data diversa (es. aggiungi il nome della missione).",
+                ephemeral=True
+            )
+            return
+        audit.emit("evento_creato", data=self.data, desc=self.desc, roles=active_roles,
+                   utente=interaction.user.name, user_id=interaction.user.id, guild_id=interaction.guild_id)
+        plane_view = PlaneSelectView(self.data, self.desc, active_roles, event["id"])
+        embed, files = await build_message(self.data, self.desc, active_roles, interaction.guild_id)
+        message = await interaction.followup.send(embed=embed, files=files, view=plane_view, wait=True)
+        # Posizione del messaggio: serve a ricollegare la view dopo un riavvio
+        await asyncio.to_thread(store.set_message, self.data, interaction.guild_id,
+                                message.channel.id, message.id)
+
+    async def save_series(self, interaction: discord.Interaction, active_roles):
+        try:
+            await asyncio.to_thread(store.create_series, self.data, self.desc, roles=active_roles,
+                                    guild_id=interaction.guild_id, channel_id=interaction.channel_id,
+                                    **self.series)
+        except sqlite3.IntegrityError:
+            await interaction.followup.send(f"⚠️ Esiste già una serie chiamata **{self.data}**.", ephemeral=True)
+            return
+        audit.emit("serie_creata", nome=self.data, desc=self.desc, roles=active_roles, **self.series,
+                   utente=interaction.user.name, user_id=interaction.user.id, guild_id=interaction.guild_id)
+        await interaction.followup.send(
+            f"🔁 Serie **{self.data}** creata: ogni {WEEKDAYS[self.series['weekday']]} alle "
+            f"{self.series['ora']}. Ogni missione verrà pubblicata in questo canale "
+            f"{self.cfg.booking_window_days} giorni prima.",
+            ephemeral=True
+        )
+
+# ============================ SESSIONI WIZARD ============================
+class SetupSessions:
+    # Wizard aperti per (guild, utente): limitati in numero e chiusi dopo
+    # setup_ttl secondi di inattività, così le view abbandonate non restano
+    # nel view store di discord.py per sempre
+    def __init__(self):
+        self._sessions = {}
+
+    def open(self, setup):
+        # Oltre il limite si chiude la procedura più vecchia invece di
+        # rifiutare: Discord non segnala la chiusura di un modal, quindi un
+        # wizard annullato resterebbe aperto fino alla scadenza
+        sessions = self._sessions.setdefault(setup.key, [])
+        while len(sessions) >= setup.cfg.max_setup_sessions:
+            self.close(sessions[0])
+            sessions = self._sessions.setdefault(setup.key, [])
+        sessions.append(setup)
+
+    def close(self, setup):
+        setup.close()
+        sessions = self._sessions.get(setup.key, [])
+        if setup in sessions:
+            sessions.remove(setup)
+        if not sessions:
+            self._sessions.pop(setup.key, None)
+
+    def evict_expired(self):
+        now = time.monotonic()
+        expired = [s for sessions in self._sessions.values() for s in sessions if s.expired(now)]
+        for setup in expired:
+            self.close(setup)
+        return len(expired)
+
+    def count(self):
+        return sum(len(sessions) for sessions in self._sessions.values())
+
+    def live_views(self):
+        return sum(len(s.views) for sessions in self._sessions.values() for s in sessions)
+
+setup_sessions = SetupSessions()
+
+def registered_view_count():
+    # Il view store è interno a discord.py: lo leggiamo solo per la metrica
+    view_store = getattr(bot._connection, "_view_store", None)
+    if view_store is None:
+        return 0
+    views = {id(item.view) for items in view_store._views.values() for item in items.values() if item.view}
+    return len(views) + len(view_store._modals)
+
+@tasks.loop(minutes=1)
+async def evict_setup_sessions():
+    evicted = setup_sessions.evict_expired()
+    if evicted:
+        print(f"🧹 Chiusi {evicted} wizard scaduti — view registrate: {registered_view_count()}")
 
 # ============================ COMANDO SLASH ============================
 @app_commands.command(name="prenotazioni", description="Crea un evento con ruoli e aerei")
@@ -278,35 +514,473 @@ class EventSetupView:
     desc="Breve descrizione della missione"
 )
 async def prenotazioni(interaction: discord.Interaction, data: str, desc: str):
-    setup = EventSetupView(data, desc)
+    # Controllo anticipato per non far compilare il wizard inutilmente;
+    # quello definitivo è in store.create_event
+    if await asyncio.to_thread(store.event_version, data):
+        await interaction.response.send_message(
+            f"⚠️ Esiste già un evento **{data}**: usa una data diversa (es. aggiungi il nome della missione).",
+            ephemeral=True
+        )
+        return
+    setup = EventSetupView(data, desc, config.for_guild(interaction.guild_id),
+                           interaction.guild_id, interaction.user.id)
+    await start_setup(interaction, setup)
+
+async def start_setup(interaction: discord.Interaction, setup):
+    setup_sessions.open(setup)
     await setup.start(interaction)
 
-for guild_id in GUILD_IDS:
-    bot.tree.add_command(prenotazioni, guild=discord.Object(id=guild_id))
+# ============================ SERIE RICORRENTI ============================
+WEEKDAYS = ["lunedì", "martedì", "mercoledì", "giovedì", "venerdì", "sabato", "domenica"]
+
+serie = app_commands.Group(name="serie", description="Missioni ricorrenti settimanali",
+                           default_permissions=discord.Permissions(manage_events=True))
+
+@serie.command(name="crea", description="Crea una serie settimanale con lo stesso layout di ruoli e aerei")
+@app_commands.describe(
+    nome="Nome della serie (compare nel titolo di ogni missione)",
+    giorno="Giorno della settimana",
+    ora="Orario della missione (es. 21:00)",
+    desc="Breve descrizione delle missioni",
+    ogni="Cadenza in settimane (1 = ogni settimana)",
+    fine="Ultima data possibile (es. 2026-06-30), facoltativa"
+)
+@app_commands.choices(giorno=[app_commands.Choice(name=d, value=i) for i, d in enumerate(WEEKDAYS)])
+async def serie_crea(interaction: discord.Interaction, nome: str, giorno: int, ora: str, desc: str,
+                     ogni: app_commands.Range[int, 1, 4] = 1, fine: str = None):
+    if not re.fullmatch(r"([01]\d|2[0-3]):[0-5]\d", ora):
+        await interaction.response.send_message("⚠️ Orario non valido, usa il formato HH:MM.", ephemeral=True)
+        return
+    try:
+        fine = date.fromisoformat(fine).isoformat() if fine else None
+    except ValueError:
+        await interaction.response.send_message("⚠️ Data di fine non valida, usa AAAA-MM-GG.", ephemeral=True)
+        return
+    series = {"weekday": giorno, "ora": ora, "ogni": ogni, "inizio": date.today().isoformat(), "fine": fine}
+    setup = EventSetupView(nome.strip(), desc, config.for_guild(interaction.guild_id),
+                           interaction.guild_id, interaction.user.id, series=series)
+    await start_setup(interaction, setup)
+
+@serie.command(name="elenco", description="Elenca le serie ricorrenti del server")
+async def serie_elenco(interaction: discord.Interaction):
+    series = await asyncio.to_thread(store.series_list, interaction.guild_id)
+    if not series:
+        await interaction.response.send_message("Nessuna serie ricorrente.", ephemeral=True)
+        return
+    lines = [
+        f"🔁 **{s['nome']}** — ogni {s['ogni']} settimana/e, {WEEKDAYS[s['weekday']]} alle {s['ora']}"
+        + (f", fino al {s['fine']}" if s["fine"] else "")
+        + (f" (ultima generata: {s['ultima']})" if s["ultima"] else "")
+        for s in series
+    ]
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+@serie.command(name="elimina", description="Ferma una serie: le missioni già pubblicate restano")
+async def serie_elimina(interaction: discord.Interaction, nome: str):
+    deleted = await asyncio.to_thread(store.delete_series, interaction.guild_id, nome)
+    if not deleted:
+        await interaction.response.send_message(f"⚠️ Nessuna serie chiamata **{nome}**.", ephemeral=True)
+        return
+    audit.emit("serie_eliminata", nome=nome, utente=interaction.user.name,
+               user_id=interaction.user.id, guild_id=interaction.guild_id)
+    await interaction.response.send_message(f"🗑️ Serie **{nome}** eliminata.", ephemeral=True)
+
+def booking_windows():
+    # {guild_id: giorni di finestra} per le guild gestite da questo processo
+    return {gid: config.for_guild(gid).booking_window_days for gid in config.guild_ids if bot.get_guild(gid)}
+
+publish_lock = asyncio.Lock()
+
+async def publish_pending(windows):
+    # Pubblica gli eventi con canale ma senza messaggio (serie e import)
+    # entrati nella finestra di prenotazione; quelli falliti si ritentano al
+    # giro successivo. Il lock evita doppi messaggi tra batch e /importa.
+    async with publish_lock:
+        now = datetime.now()
+        pending = await asyncio.to_thread(store.unpublished_events, now.date().isoformat(), set(windows))
+        published = 0
+        for event in pending:
+            when = parse_mission_date(event["data"])
+            if when and (when.date() - now.date()).days > windows[event["guild_id"]]:
+                continue
+            channel = bot.get_channel(event["channel_id"])
+            if channel is None:
+                print(f"Canale non trovato, missione {event['data']} non pubblicata (nuovo tentativo al prossimo batch)")
+                continue
+            embed, files = await build_message(event["data"], event["desc"], event["roles"], event["guild_id"])
+            try:
+                message = await channel.send(
+                    embed=embed,
+                    files=files,
+                    view=PlaneSelectView(event["data"], event["desc"], event["roles"], event["id"])
+                )
+            except discord.HTTPException as e:
+                print(f"Errore pubblicazione {event['data']} (nuovo tentativo al prossimo batch): {e}")
+                continue
+            await asyncio.to_thread(store.set_message, event["data"], event["guild_id"], channel.id, message.id)
+            published += 1
+        return published
+
+@tasks.loop(minutes=15)
+async def materialize_series():
+    # Batch periodico: crea solo le occorrenze entrate nella finestra di
+    # prenotazione delle guild gestite da questo processo, poi pubblica
+    # tutti gli eventi ancora senza messaggio (anche quelli falliti in precedenza)
+    windows = booking_windows()
+    try:
+        created, clashes = await asyncio.to_thread(store.materialize_due, datetime.now(), windows)
+    except Exception as e:
+        print(f"Errore generazione serie: {e}")
+        return
+    for series, event in created:
+        audit.emit("evento_creato", data=event["data"], desc=event["desc"], roles=event["roles"],
+                   guild_id=series["guild_id"], origine="serie")
+    for series, data in clashes:
+        print(f"⚠️ Serie {series['nome']}: la missione {data} esiste già e non appartiene alla serie")
+    try:
+        published = await publish_pending(windows)
+    except Exception as e:
+        print(f"Errore pubblicazione eventi: {e}")
+        return
+    if created or published:
+        print(f"🔁 Generate {len(created)} missioni dalle serie ricorrenti, pubblicate {published}")
+
+# ============================ PROFILING ============================
+# Classi a cui il campionatore attribuisce il tempo del loop
+PROFILED_CLASSES = (discord.ui.View, discord.ui.Item, discord.ui.Modal, EventSetupView)
+
+@app_commands.command(name="profilo", description="Avvia una sessione di profiling del bot (solo admin)")
+@app_commands.describe(
+    modo="cpu (cProfile), memoria (tracemalloc) o campionamento (per view e callback)",
+    secondi="Durata della sessione in secondi"
+)
+@app_commands.choices(modo=[app_commands.Choice(name=m, value=m) for m in MODES])
+@app_commands.default_permissions(administrator=True)
+async def profilo(interaction: discord.Interaction, modo: str, secondi: app_commands.Range[int, 1, 300] = 30):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("⛔ Comando riservato agli amministratori.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        paths = await run_profile(modo, secondi, PROFILED_CLASSES)
+    except ProfilingBusy as e:
+        await interaction.followup.send(f"⚠️ {e}", ephemeral=True)
+        return
+    await interaction.followup.send(
+        f"📊 Profiling **{modo}** di {secondi}s completato.",
+        files=[discord.File(p) for p in paths],
+        ephemeral=True
+    )
+
+# ============================ IMPORT / EXPORT ============================
+@app_commands.command(name="importa", description="Importa eventi da un file CSV o JSONL (solo admin)")
+@app_commands.describe(file="File .csv (una riga per ruolo) o .jsonl (un evento per riga)")
+@app_commands.default_permissions(administrator=True)
+async def importa(interaction: discord.Interaction, file: discord.Attachment):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("⛔ Comando riservato agli amministratori.", ephemeral=True)
+        return
+    cfg = config.for_guild(interaction.guild_id)
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    def audit_batch(batch):
+        for event in batch:
+            audit.emit("evento_creato", data=event["data"], desc=event["desc"], roles=event["roles"],
+                       utente=interaction.user.name, user_id=interaction.user.id,
+                       guild_id=interaction.guild_id, origine="import")
+
+    try:
+        fmt = detect_format(file.filename)
+        payload = await file.read()
+        # Gli eventi appartengono alla guild e vengono pubblicati in questo canale
+        count = await asyncio.to_thread(import_bytes, store, payload, fmt,
+                                        cfg.default_slots, cfg.planes, audit_batch,
+                                        interaction.guild_id, interaction.channel_id)
+    except BulkError as e:
+        imported = f" ({e.imported} eventi già importati)" if e.imported else ""
+        await interaction.followup.send(f"❌ Import interrotto: {e}{imported}", ephemeral=True)
+        if e.imported:
+            await publish_pending(booking_windows())
+        return
+    await interaction.followup.send(
+        f"✅ Importati {count} eventi da **{file.filename}**. Le missioni vengono pubblicate in questo "
+        f"canale {cfg.booking_window_days} giorni prima.",
+        ephemeral=True
+    )
+    await publish_pending(booking_windows())
+
+@app_commands.command(name="esporta", description="Esporta gli eventi e i roster di questo server (solo admin)")
+@app_commands.choices(formato=[app_commands.Choice(name=f, value=f) for f in FORMATS])
+@app_commands.default_permissions(administrator=True)
+async def esporta(interaction: discord.Interaction, formato: str = "csv"):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("⛔ Comando riservato agli amministratori.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    def write():
+        # Su file temporaneo: l'export non passa mai interamente in memoria
+        fd, path = tempfile.mkstemp(suffix=f".{formato}")
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            count = export_events(store, f, formato, interaction.guild_id)
+        return path, count
+
+    path, count = await asyncio.to_thread(write)
+    try:
+        await interaction.followup.send(
+            f"📦 Esportati {count} eventi.",
+            file=discord.File(path, filename=f"prenotazioni.{formato}"),
+            ephemeral=True
+        )
+    finally:
+        os.remove(path)
+
+# ============================ STATISTICHE ============================
+def _ranking(rows):
+    return "\n".join(f"**{name}** — {count}" for name, count in rows) or "Nessun dato"
+
+@app_commands.command(name="statistiche", description="Statistiche di partecipazione per pilota, ruolo e aereo")
+@app_commands.describe(pilota="Pilota di cui mostrare le statistiche (default: classifiche generali)")
+async def statistiche(interaction: discord.Interaction, pilota: discord.User = None):
+    # I contatori sono aggiornati a ogni prenotazione: qui solo letture puntuali
+    if pilota:
+        stats = await asyncio.to_thread(store.pilot_stats, pilota.name)
+        embed = discord.Embed(title=f"📊 Statistiche di {pilota.name}", color=0x1abc9c)
+        embed.add_field(name="Sortite", value=str(stats["sortite"]), inline=False)
+        embed.add_field(name="Ruoli", value=_ranking(stats["ruoli"]), inline=True)
+        embed.add_field(name="Aerei", value=_ranking(stats["aerei"]), inline=True)
+    else:
+        stats = await asyncio.to_thread(store.global_stats)
+        embed = discord.Embed(title="📊 Statistiche dello squadrone", color=0x1abc9c)
+        embed.add_field(name="Piloti più presenti", value=_ranking(stats["piloti"]), inline=False)
+        embed.add_field(name="Ruoli", value=_ranking(stats["ruoli"]), inline=True)
+        embed.add_field(name="Aerei", value=_ranking(stats["aerei"]), inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+GUILD_COMMANDS = [prenotazioni, serie, profilo, importa, esporta, statistiche]
+
+for guild_id in config.guild_ids:
+    for command in GUILD_COMMANDS:
+        bot.tree.add_command(command, guild=discord.Object(id=guild_id))
+
+# ============================ RELOAD CONFIGURAZIONE ============================
+@tasks.loop(seconds=5)
+async def watch_config():
+    global config
+    try:
+        mtime = os.stat(CONFIG_PATH).st_mtime
+        if mtime == config.mtime:
+            return
+        new_config = await asyncio.to_thread(load_config, CONFIG_PATH)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Errore ricaricamento configurazione: {e}")
+        return
+
+    old_ids = set(config.guild_ids)
+    new_ids = set(new_config.guild_ids)
+    config = new_config
+    print(f"🔁 Configurazione ricaricata ({len(new_ids)} guild)")
+
+    # Solo le guild aggiunte o rimosse richiedono una nuova sincronizzazione
+    for guild_id in old_ids - new_ids:
+        for command in GUILD_COMMANDS:
+            bot.tree.remove_command(command.name, guild=discord.Object(id=guild_id))
+        await sync_guild(guild_id)
+    for guild_id in new_ids - old_ids:
+        for command in GUILD_COMMANDS:
+            bot.tree.add_command(command, guild=discord.Object(id=guild_id))
+        await sync_guild(guild_id)
+
+async def sync_guild(guild_id):
+    # Con più processi ogni guild viene sincronizzata solo dal
+    # processo che ne gestisce lo shard
+    if bot.get_guild(guild_id) is None:
+        return
+    try:
+        synced = await bot.tree.sync(guild=discord.Object(id=guild_id))
+        print(f"🔄 Sincronizzati {len(synced)} comandi slash per guild {guild_id}")
+    except Exception as e:
+        print(f"Errore sync: {e}")
+
+# ============================ RIAVVIO A CALDO ============================
+# Numero massimo di messaggi riconciliati in parallelo: discord.py gestisce
+# i 429, questo limite evita di arrivarci in blocco dopo un riavvio
+RECONCILE_CONCURRENCY = int(os.environ.get("RECONCILE_CONCURRENCY", 4))
+
+def register_event_views(event):
+    # Il messaggio può mostrare la selezione aereo o i pulsanti di un aereo:
+    # si registrano tutte le varianti per lo stesso message_id
+    roles = event["roles"]
+    bot.add_view(PlaneSelectView(event["data"], event["desc"], roles, event["id"]),
+                 message_id=event["message_id"])
+    for plane in active_planes(roles):
+        bot.add_view(BookingView(event["data"], event["desc"], roles, plane, event["id"]),
+                     message_id=event["message_id"])
+
+def embed_signature(embed):
+    # Solo ciò che il bot controlla: proxy_url e dimensioni dell'immagine
+    # aggiunti da Discord non devono far sembrare diverso un embed. Per la
+    # card l'URL "attachment://" diventa un URL CDN: conta solo il nome file.
+    image = (embed.image.url or "").split("?")[0].rsplit("/", 1)[-1]
+    return (
+        embed.title,
+        embed.description,
+        tuple((f.name, f.value) for f in embed.fields),
+        embed.footer.text,
+        image,
+    )
+
+async def reconcile_event(event, semaphore, report):
+    async with semaphore:
+        try:
+            channel = bot.get_channel(event["channel_id"]) or await bot.fetch_channel(event["channel_id"])
+            message = await channel.fetch_message(event["message_id"])
+        except (discord.NotFound, discord.Forbidden):
+            # Messaggio cancellato o non più accessibile: si smette di seguirlo
+            await asyncio.to_thread(store.clear_message, event["data"])
+            report["persi"] += 1
+            return
+        except discord.HTTPException as e:
+            print(f"Errore riconciliazione {event['data']}: {e}")
+            report["errori"] += 1
+            return
+
+        report["verificati"] += 1
+        # Confronto senza renderizzare: la card si genera solo se va aggiornata
+        embed = generate_embed(event["data"], event["desc"], event["roles"], event["guild_id"])
+        if card_enabled(event["guild_id"]):
+            embed.set_image(url=f"attachment://{CARD_FILENAME}")
+        if message.embeds and embed_signature(message.embeds[0]) == embed_signature(embed):
+            return
+        embed, files = await build_message(event["data"], event["desc"], event["roles"], event["guild_id"])
+        view = PlaneSelectView(event["data"], event["desc"], event["roles"], event["id"])
+        try:
+            await message.edit(embed=embed, attachments=files, view=view)
+        except discord.HTTPException as e:
+            print(f"Errore aggiornamento {event['data']}: {e}")
+            report["errori"] += 1
+            return
+        report["aggiornati"] += 1
+
+async def reconcile_messages():
+    live = await asyncio.to_thread(store.live_events)
+    # Ogni processo riconcilia solo le guild dei propri shard
+    live = [e for e in live if bot.get_guild(e["guild_id"]) is not None]
+    report = {"verificati": 0, "aggiornati": 0, "persi": 0, "errori": 0}
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    # Un evento che fallisce non deve impedire il resoconto finale
+    results = await asyncio.gather(*(reconcile_event(e, semaphore, report) for e in live),
+                                   return_exceptions=True)
+    for event, result in zip(live, results):
+        if isinstance(result, Exception):
+            print(f"Errore riconciliazione {event['data']}: {result!r}")
+            report["errori"] += 1
+    print(f"⏱️ Operativo dopo {time.monotonic() - STARTED_AT:.1f}s — "
+          f"{report['verificati']} messaggi verificati, {report['aggiornati']} aggiornati, "
+          f"{report['persi']} non più disponibili, {report['errori']} errori")
+
+@bot.event
+async def setup_hook():
+    # Prima della connessione: i click arrivati subito dopo il riavvio
+    # trovano già la loro view
+    live = await asyncio.to_thread(store.live_events)
+    for event in live:
+        register_event_views(event)
+    print(f"🔗 Registrate le view di {len(live)} messaggi di prenotazione")
 
 # ============================ ON_READY ============================
+reconcile_task = None
+
 @bot.event
 async def on_ready():
+    global reconcile_task
     print(f"✅ Bot connesso come {bot.user}")
-    try:
-        for guild_id in GUILD_IDS:
-            synced = await bot.tree.sync(guild=discord.Object(id=guild_id))
-            print(f"🔄 Sincronizzati {len(synced)} comandi slash per guild {guild_id}")
-    except Exception as e:
-        print(f"Errore sync: {e}")
+    for guild_id in config.guild_ids:
+        await sync_guild(guild_id)
+    if not watch_config.is_running():
+        watch_config.start()
+    if not evict_setup_sessions.is_running():
+        evict_setup_sessions.start()
+    if backups and not backup_store.is_running():
+        backup_store.start()
+    if not materialize_series.is_running():
+        materialize_series.start()
+    # on_ready si ripete a ogni riconnessione: la riconciliazione no
+    if reconcile_task is None:
+        reconcile_task = asyncio.create_task(reconcile_messages())
 
 # ============================ WEB SERVER ============================
 app = Flask('')
+app.register_blueprint(create_roster_api(store))
 
 @app.route('/')
 def home():
     return "Bot attivo!"
 
+async def collect_metrics():
+    return {
+        "wizard_sessioni_attive": setup_sessions.count(),
+        "wizard_view_attive": setup_sessions.live_views(),
+        "discord_view_registrate": registered_view_count(),
+        "card_hit": card_renderer.hits if card_renderer else 0,
+        "card_miss": card_renderer.misses if card_renderer else 0,
+        "card_accorpate": card_renderer.coalesced if card_renderer else 0,
+    }
+
+def bot_loop():
+    # Prima del login bot.loop è un segnaposto di discord.py, non un loop
+    loop = bot.loop
+    if isinstance(loop, asyncio.AbstractEventLoop) and loop.is_running():
+        return loop
+    return None
+
+@app.route('/metrics')
+def metrics():
+    # Le strutture del bot si leggono solo dal suo loop
+    loop = bot_loop()
+    if loop is None:
+        return "Bot in avvio\n", 503, {"Content-Type": "text/plain; version=0.0.4", "Retry-After": "5"}
+    values = asyncio.run_coroutine_threadsafe(collect_metrics(), loop).result(timeout=5)
+    body = "".join(f"{name} {value}\n" for name, value in values.items())
+    return body, 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+@app.route('/debug/profilo')
+def debug_profilo():
+    # Flask gira in un altro thread: la sessione va eseguita sul loop del bot
+    # Confronto a tempo costante: il token non si indovina un carattere alla volta
+    auth = request.headers.get("Authorization", "").encode("utf-8")
+    if not PROFILE_TOKEN or not hmac.compare_digest(auth, f"Bearer {PROFILE_TOKEN}".encode("utf-8")):
+        abort(404)
+    modo = request.args.get("modo", "cpu")
+    if modo not in MODES:
+        abort(400)
+    secondi = max(1, min(request.args.get("secondi", 30, type=int), 300))
+    loop = bot_loop()
+    if loop is None:
+        return "Bot in avvio", 503, {"Retry-After": "5"}
+    future = asyncio.run_coroutine_threadsafe(run_profile(modo, secondi, PROFILED_CLASSES), loop)
+    try:
+        paths = future.result(timeout=secondi + 60)
+    except ProfilingBusy as e:
+        return str(e), 409
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        return "Sessione di profiling non conclusa in tempo", 504
+    except Exception as e:
+        print(f"Errore profiling via HTTP: {e!r}")
+        return f"Errore durante il profiling: {e}", 500
+    return send_file(os.path.abspath(paths[0]), mimetype="text/plain")
+
 def run():
     port = int(os.environ.get("PORT", 3000))
     app.run(host='0.0.0.0', port=port)
 
-Thread(target=run).start()
+if WEB_SERVER:
+    Thread(target=run).start()
 
 # ============================ AVVIO BOT ============================
-bot.run(TOKEN)
+try:
+    bot.run(TOKEN)
+finally:
+    # Il thread di audit è daemon: senza close gli ultimi eventi andrebbero persi
+    audit.close()
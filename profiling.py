@@ -0,0 +1,152 @@
+# ============================ PROFILING ============================
+# Sessioni di profiling a tempo dentro il bot in esecuzione: cProfile,
+# differenza tra due snapshot tracemalloc, oppure un campionatore a basso
+# costo che attribuisce il tempo del loop alle classi di view e callback.
+# Le coroutine vanno eseguite sul loop del bot: cProfile misura il thread
+# in cui viene attivato.
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profili")
+MODES = ("cpu", "memoria", "campionamento")
+MAX_SECONDS = 300
+MIN_INTERVAL = 0.005
+MAX_STACK_DEPTH = 64
+
+_busy = asyncio.Lock()
+
+
+class ProfilingBusy(Exception):
+    pass
+
+
+def _report_path(kind, ext):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.{ext}")
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+# ---------------------------- CPROFILE ----------------------------
+async def _profile_cpu(seconds):
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        prof.disable()
+
+    def write():
+        raw = _report_path("cpu", "pstats")
+        prof.dump_stats(raw)
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(40)
+        return [_write(raw[:-len(".pstats")] + ".txt", out.getvalue()), raw]
+
+    return await asyncio.to_thread(write)
+
+
+# ---------------------------- TRACEMALLOC ----------------------------
+async def _profile_memory(seconds, top=40):
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    def write():
+        diff = after.compare_to(before, "lineno")
+        lines = [f"Differenza allocazioni in {seconds}s (prime {top} righe)", ""]
+        lines += [str(stat) for stat in diff[:top]]
+        return [_write(_report_path("memoria", "txt"), "\n".join(lines) + "\n")]
+
+    return await asyncio.to_thread(write)
+
+
+# ---------------------------- CAMPIONAMENTO ----------------------------
+class Sampler:
+    # Un thread legge lo stack del loop ogni `interval` secondi e attribuisce
+    # il campione alla view/callback più interna presente nello stack.
+    # Il costo è limitato: un campione per intervallo, profondità massima fissa.
+    def __init__(self, thread_id, classes, interval):
+        self.thread_id = thread_id
+        self.classes = classes
+        self.interval = max(interval, MIN_INTERVAL)
+        self.samples = Counter()
+        self.total = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[self._attribute(frame)] += 1
+                self.total += 1
+
+    def _attribute(self, frame):
+        top = frame.f_code
+        depth = 0
+        while frame is not None and depth < MAX_STACK_DEPTH:
+            owner = frame.f_locals.get("self")
+            if owner is not None and isinstance(owner, self.classes):
+                return f"{type(owner).__qualname__}.{frame.f_code.co_name}"
+            frame = frame.f_back
+            depth += 1
+        if top.co_name in ("select", "poll", "epoll"):
+            return "(loop inattivo)"
+        return f"(altro) {top.co_name}"
+
+
+async def _profile_sampling(seconds, classes, interval):
+    sampler = Sampler(threading.get_ident(), classes, interval)
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await asyncio.to_thread(sampler.stop)
+
+    lines = [f"Campionamento di {seconds}s ogni {sampler.interval * 1000:.0f}ms: {sampler.total} campioni", ""]
+    for key, count in sampler.samples.most_common():
+        lines.append(f"{count / sampler.total * 100:6.1f}%  {count:6d}  {key}")
+    return await asyncio.to_thread(lambda: [_write(_report_path("campionamento", "txt"), "\n".join(lines) + "\n")])
+
+
+# ---------------------------- INGRESSO ----------------------------
+async def run_profile(mode, seconds, classes=(), interval=0.01):
+    # Restituisce la lista dei file di report, il primo è sempre testuale
+    if mode not in MODES:
+        raise ValueError(f"modo sconosciuto: {mode}")
+    seconds = max(1, min(int(seconds), MAX_SECONDS))
+    if _busy.locked():
+        raise ProfilingBusy("una sessione di profiling è già in corso")
+    async with _busy:
+        if mode == "cpu":
+            return await _profile_cpu(seconds)
+        if mode == "memoria":
+            return await _profile_memory(seconds)
+        return await _profile_sampling(seconds, classes, interval)
@@ -0,0 +1,57 @@
+# ============================ REPLAY AUDIT ============================
+# Riapplica il flusso di audit su uno store nuovo per ricostruire lo stato
+# e misurare il throughput di elaborazione.
+#
+#   python replay_audit.py --audit audit --db replay.db
+import argparse
+import os
+import tempfile
+import time
+
+from audit import AUDIT_DIR, read_stream
+from store import BookingStore
+
+
+def replay(records, store):
+    stats = {"letti": 0, "applicati": 0, "discrepanze": 0}
+    for record in records:
+        stats["letti"] += 1
+        kind = record["tipo"]
+        if kind == "evento_creato":
+            store.create_event(record["data"], record.get("desc", ""), record["roles"])
+            stats["applicati"] += 1
+        elif kind == "prenotazione" and record["esito"] in ("prenotato", "rimosso"):
+            esito, _ = store.toggle_booking(record["data"], record["ruolo"], record["utente"])
+            stats["applicati"] += 1
+            # Un esito diverso indica uno stream incompleto o fuori ordine
+            if esito != record["esito"]:
+                stats["discrepanze"] += 1
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Riproduce lo stream di audit su uno store nuovo")
+    parser.add_argument("--audit", default=AUDIT_DIR, help="cartella con i file eventi-*.jsonl[.gz]")
+    parser.add_argument("--db", help="database di destinazione (default: file temporaneo)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, "replay.db")
+        if os.path.exists(path):
+            parser.error(f"{path} esiste già: il replay richiede uno store vuoto")
+        store = BookingStore(path)
+        start = time.perf_counter()
+        stats = replay(read_stream(args.audit), store)
+        elapsed = time.perf_counter() - start
+        events = len(store.events())
+        store.close()
+
+    rate = stats["letti"] / elapsed if elapsed else 0
+    print(f"Letti {stats['letti']} eventi, applicati {stats['applicati']}, "
+          f"discrepanze {stats['discrepanze']}")
+    print(f"Eventi nello store: {events}")
+    print(f"Tempo {elapsed:.2f}s — {rate:.0f} eventi/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# ============================ API ROSTER ============================
+# Endpoint JSON in sola lettura per il sito dello squadrone.
+# Ogni evento ha un numero di versione nello store: l'ETag ne deriva, la
+# risposta viene serializzata una sola volta per versione e i client con
+# If-None-Match ricevono 304. Per evitare il polling si può usare il
+# long-poll (?attendi=secondi) oppure lo stream SSE.
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import Blueprint, Response, abort, request
+
+from store import parse_mission_date
+
+MAX_WAIT = 60
+POLL_INTERVAL = 0.5
+SSE_HEARTBEAT = 15
+# Risposte serializzate tenute in cache (le meno usate escono per prime)
+CACHE_ENTRIES = 1024
+
+
+class RosterCache:
+    # chiave -> (versione, etag, corpo serializzato), LRU limitata
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key, version):
+        # (etag, corpo) se in cache per questa versione, altrimenti None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+        if entry and entry[0] == version:
+            return entry[1], entry[2]
+        return None
+
+    def get(self, key, version, build):
+        cached = self.lookup(key, version)
+        if cached:
+            return cached
+        body = json.dumps(build(), ensure_ascii=False).encode("utf-8")
+        etag = _etag(key, version)
+        with self._lock:
+            self._entries[key] = (version, etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag, body
+
+
+def _etag(key, version):
+    return f"{key}-{version}"
+
+
+def _roster(event):
+    return {
+        "data": event["data"],
+        "desc": event["desc"],
+        "versione": event["version"],
+        "ruoli": [
+            {
+                "nome": role,
+                "aereo": info["plane"],
+                "slot": info["slots"],
+                "piloti": info["users"],
+            }
+            for role, info in event["roles"].items()
+        ],
+    }
+
+
+def create_roster_api(store):
+    api = Blueprint("roster_api", __name__, url_prefix="/api")
+    cache = RosterCache()
+
+    def _response(etag, body):
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def _wait_for_change(data, etag, seconds):
+        # Long-poll: attende finché la versione non cambia rispetto all'ETag
+        # del client. Legge solo (id, versione), quindi funziona anche se la
+        # modifica arriva da un altro processo shard.
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            current = store.event_version(data)
+            if current is None or _etag(*current) != etag:
+                return
+            time.sleep(POLL_INTERVAL)
+
+    def _event_response(data):
+        # Prima solo (id, versione): il roster si carica e si decodifica
+        # unicamente quando la versione non è in cache
+        current = store.event_version(data)
+        cached = cache.lookup(*current) if current else None
+        if cached:
+            return cached
+        event = store.get_event(data)
+        if event is None:
+            abort(404)
+        return cache.get(event["id"], event["version"], lambda: _roster(event))
+
+    @api.route("/eventi")
+    def upcoming_events():
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        day = today.strftime("%Y-%m-%d")
+        # La lista cambia solo quando cambia un evento futuro o a mezzanotte:
+        # la versione è l'impronta delle coppie (id, versione) degli eventi
+        # futuri, letta senza caricare i roster
+        key = f"eventi{today.strftime('%Y%m%d')}"
+        versions = store.upcoming_versions(day)
+        version = hashlib.sha1(repr(versions).encode("ascii")).hexdigest()[:16]
+
+        def build():
+            upcoming = []
+            for event in store.upcoming_events(day):
+                when = parse_mission_date(event["data"])
+                if when is None or when < today:
+                    continue
+                upcoming.append({
+                    "data": event["data"],
+                    "desc": event["desc"],
+                    "versione": event["version"],
+                    "prenotati": sum(len(info["users"]) for info in event["roles"].values()),
+                    "slot": sum(info["slots"] for info in event["roles"].values()),
+                })
+            upcoming.sort(key=lambda e: parse_mission_date(e["data"]))
+            return upcoming
+
+        return _response(*cache.get(key, version, build))
+
+    @api.route("/eventi/<path:data>")
+    def event_roster(data):
+        wait = min(request.args.get("attendi", 0, type=int), MAX_WAIT)
+        if wait > 0:
+            for etag in request.if_none_match:
+                _wait_for_change(data, etag, wait)
+                break
+        etag, body = _event_response(data)
+        return _response(etag, body)
+
+    @api.route("/stream/<path:data>")
+    def event_stream(data):
+        # Server-Sent Events: un messaggio a ogni nuova versione del roster
+        etag, body = _event_response(data)
+
+        def generate(etag, body):
+            last_sent = time.monotonic()
+            yield f"id: {etag}\ndata: {body.decode('utf-8')}\n\n"
+            while True:
+                time.sleep(POLL_INTERVAL)
+                current = store.event_version(data)
+                if current is None:
+                    yield "event: eliminato\ndata: {}\n\n"
+                    return
+                if _etag(*current) != etag:
+                    etag, body = _event_response(data)
+                    yield f"id: {etag}\ndata: {body.decode('utf-8')}\n\n"
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent > SSE_HEARTBEAT:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+
+        return Response(generate(etag, body), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    return api
@@ -0,0 +1,597 @@
+# ============================ STORE PRENOTAZIONI ============================
+# Stato delle prenotazioni su SQLite in modalità WAL: più processi del bot
+# (uno per gruppo di shard) leggono e scrivono lo stesso file locale.
+# Ogni modifica è una transazione BEGIN IMMEDIATE, quindi il lock in
+# scrittura è condiviso tra processi e ogni lettura vede conteggi coerenti.
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+DB_PATH = os.environ.get("BOOKINGS_DB", "prenotazioni.db")
+LEGACY_JSON = "prenotazioni.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL UNIQUE,
+    desc TEXT NOT NULL DEFAULT '',
+    roles TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    seq INTEGER NOT NULL DEFAULT 0,
+    guild_id INTEGER,
+    channel_id INTEGER,
+    message_id INTEGER,
+    series_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    sub TEXT NOT NULL DEFAULT '',
+    count INTEGER NOT NULL,
+    PRIMARY KEY (kind, key, sub)
+);
+CREATE INDEX IF NOT EXISTS stats_top ON stats (kind, count DESC);
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome TEXT NOT NULL,
+    desc TEXT NOT NULL DEFAULT '',
+    weekday INTEGER NOT NULL,
+    ora TEXT NOT NULL,
+    ogni INTEGER NOT NULL DEFAULT 1,
+    inizio TEXT NOT NULL,
+    fine TEXT,
+    roles TEXT NOT NULL,
+    guild_id INTEGER,
+    channel_id INTEGER,
+    ultima TEXT,
+    UNIQUE (guild_id, nome)
+);
+"""
+
+_COLUMNS = "id, data, desc, roles, version, seq, guild_id, channel_id, message_id, series_id"
+_SERIES_COLUMNS = "id, nome, desc, weekday, ora, ogni, inizio, fine, roles, guild_id, channel_id, ultima"
+
+# Colonne aggiunte dopo la prima versione dello schema
+_ADDED_COLUMNS = (
+    ("guild_id", "INTEGER"),
+    ("channel_id", "INTEGER"),
+    ("message_id", "INTEGER"),
+    ("series_id", "INTEGER"),
+)
+
+# Formati accettati per la data della missione (es. "2025-09-22 18:00")
+_DATE_FORMATS = (("%Y-%m-%d %H:%M", 16), ("%Y-%m-%d", 10))
+
+
+class EventExists(Exception):
+    # La data è la chiave dell'evento in tutto lo store, per tutte le guild
+    pass
+
+
+def parse_mission_date(data):
+    # La data è testo libero: None se non inizia con una data riconoscibile
+    for fmt, length in _DATE_FORMATS:
+        try:
+            return datetime.strptime(data[:length], fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _contributions(roles):
+    # Ogni prenotazione conta per pilota, pilota/ruolo, pilota/aereo, ruolo e aereo
+    for role, info in roles.items():
+        for user in info["users"]:
+            yield user, role, info["plane"]
+
+
+def _stat_keys(user, role, plane):
+    return (
+        ("pilota", user, ""),
+        ("pilota_ruolo", user, role),
+        ("pilota_aereo", user, plane),
+        ("ruolo", role, ""),
+        ("aereo", plane, ""),
+    )
+
+
+def occurrence_key(series, day):
+    # Chiave dell'evento generato: inizia con data e ora, come quelle manuali.
+    # Il nome è unico solo per guild, la data degli eventi in tutto lo store:
+    # l'id della serie evita che due guild si contendano la stessa chiave
+    return f"{day.isoformat()} {series['ora']} {series['nome']} #{series['id']}"
+
+
+def next_occurrence(series, after=None):
+    # Prima data valida della serie successiva ad `after` (esclusa)
+    start = date.fromisoformat(series["inizio"])
+    first = start + timedelta(days=(series["weekday"] - start.weekday()) % 7)
+    if after is None or after < first:
+        return first
+    step = 7 * series["ogni"]
+    return first + timedelta(days=((after - first).days // step + 1) * step)
+
+
+def _row_to_series(row):
+    keys = [c.strip() for c in _SERIES_COLUMNS.split(",")]
+    series = dict(zip(keys, row))
+    series["roles"] = json.loads(series["roles"])
+    return series
+
+
+def _row_to_event(row):
+    if row is None:
+        return None
+    return {
+        "id": row[0],
+        "data": row[1],
+        "desc": row[2],
+        "roles": json.loads(row[3]),
+        "version": row[4],
+        "seq": row[5],
+        "guild_id": row[6],
+        "channel_id": row[7],
+        "message_id": row[8],
+        "series_id": row[9],
+    }
+
+
+class BookingStore:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        # sqlite3 non condivide le connessioni tra thread: una per thread
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+        self._migrate()
+        # Database creati prima delle statistiche: si ricostruiscono una volta
+        if not self._conn().execute("SELECT 1 FROM meta WHERE key = 'stats'").fetchone():
+            self.rebuild_stats()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self):
+        existing = {row[1] for row in self._conn().execute("PRAGMA table_info(events)")}
+        for name, kind in _ADDED_COLUMNS:
+            if name not in existing:
+                try:
+                    self._conn().execute(f"ALTER TABLE events ADD COLUMN {name} {kind}")
+                except sqlite3.OperationalError:
+                    # Un altro processo ha appena aggiunto la stessa colonna
+                    pass
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE prende subito il lock di scrittura: nessun altro
+        # processo può modificare l'evento tra la nostra lettura e la scrittura
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _next_seq(self, cur):
+        cur.execute(
+            "INSERT INTO meta (key, value) VALUES ('seq', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+        return cur.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+
+    # ---------------------------- LETTURA ----------------------------
+    def get_event(self, data):
+        row = self._conn().execute(
+            f"SELECT {_COLUMNS} FROM events WHERE data = ?", (data,)
+        ).fetchone()
+        return _row_to_event(row)
+
+    def events(self):
+        rows = self._conn().execute(f"SELECT {_COLUMNS} FROM events ORDER BY id").fetchall()
+        return [_row_to_event(row) for row in rows]
+
+    def iter_events(self, batch=500, guild_id=None):
+        # Paginazione per id: in memoria c'è al massimo un lotto alla volta
+        # e nessuna transazione resta aperta tra un lotto e l'altro.
+        # Con guild_id solo gli eventi di quella guild.
+        last_id = 0
+        where = "id > ?" if guild_id is None else "id > ? AND guild_id = ?"
+        while True:
+            params = (last_id, batch) if guild_id is None else (last_id, guild_id, batch)
+            rows = self._conn().execute(
+                f"SELECT {_COLUMNS} FROM events WHERE {where} ORDER BY id LIMIT ?", params
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield _row_to_event(row)
+            last_id = rows[-1][0]
+
+    def live_events(self):
+        # Eventi con un messaggio di prenotazione pubblicato
+        rows = self._conn().execute(
+            f"SELECT {_COLUMNS} FROM events WHERE message_id IS NOT NULL ORDER BY id"
+        ).fetchall()
+        return [_row_to_event(row) for row in rows]
+
+    def upcoming_versions(self, day):
+        # Gli eventi con data riconoscibile iniziano con AAAA-MM-GG: il
+        # confronto tra stringhe sull'indice UNIQUE di data seleziona solo
+        # quelli da `day` in poi (":" è il carattere dopo "9")
+        return self._conn().execute(
+            "SELECT id, version FROM events WHERE data >= ? AND data < ':' ORDER BY id", (day,)
+        ).fetchall()
+
+    def upcoming_events(self, day):
+        rows = self._conn().execute(
+            f"SELECT {_COLUMNS} FROM events WHERE data >= ? AND data < ':' ORDER BY id", (day,)
+        ).fetchall()
+        return [_row_to_event(row) for row in rows]
+
+    def event_version(self, data):
+        # Solo (id, versione): la query più economica per ETag e long-poll
+        return self._conn().execute(
+            "SELECT id, version FROM events WHERE data = ?", (data,)
+        ).fetchone()
+
+    def seq(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+        return row[0] if row else 0
+
+    def snapshot(self, since_seq=0):
+        # Lettura in un'unica transazione: chiavi ed eventi modificati dopo
+        # since_seq fotografano lo stesso istante anche con scritture in corso
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+            keys = [r[0] for r in conn.execute("SELECT data FROM events ORDER BY id")]
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM events WHERE seq > ? ORDER BY id", (since_seq,)
+            ).fetchall()
+            series = conn.execute(f"SELECT {_SERIES_COLUMNS} FROM series ORDER BY id").fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return (row[0] if row else 0), keys, [_row_to_event(r) for r in rows], [_row_to_series(r) for r in series]
+
+    # ---------------------------- STATISTICHE ----------------------------
+    def pilot_stats(self, user):
+        # Solo letture per chiave primaria: tempo costante rispetto allo storico
+        conn = self._conn()
+        sorties = conn.execute(
+            "SELECT count FROM stats WHERE kind = 'pilota' AND key = ? AND sub = ''", (user,)
+        ).fetchone()
+        roles = conn.execute(
+            "SELECT sub, count FROM stats WHERE kind = 'pilota_ruolo' AND key = ? ORDER BY count DESC", (user,)
+        ).fetchall()
+        planes = conn.execute(
+            "SELECT sub, count FROM stats WHERE kind = 'pilota_aereo' AND key = ? ORDER BY count DESC", (user,)
+        ).fetchall()
+        return {"sortite": sorties[0] if sorties else 0, "ruoli": roles, "aerei": planes}
+
+    def global_stats(self, top=5):
+        conn = self._conn()
+
+        def ranking(kind):
+            return conn.execute(
+                "SELECT key, count FROM stats WHERE kind = ? ORDER BY count DESC LIMIT ?", (kind, top)
+            ).fetchall()
+
+        return {"piloti": ranking("pilota"), "ruoli": ranking("ruolo"), "aerei": ranking("aereo")}
+
+    def _bump_stats(self, cur, user, role, plane, delta):
+        for kind, key, sub in _stat_keys(user, role, plane):
+            cur.execute(
+                "INSERT INTO stats (kind, key, sub, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(kind, key, sub) DO UPDATE SET count = count + excluded.count",
+                (kind, key, sub, delta),
+            )
+            if delta < 0:
+                cur.execute(
+                    "DELETE FROM stats WHERE kind = ? AND key = ? AND sub = ? AND count <= 0",
+                    (kind, key, sub),
+                )
+
+    def _apply_event_stats(self, cur, roles, delta):
+        for user, role, plane in _contributions(roles):
+            self._bump_stats(cur, user, role, plane, delta)
+
+    def _compute_stats(self):
+        counts = {}
+        for event in self.iter_events():
+            for contribution in _contributions(event["roles"]):
+                for stat_key in _stat_keys(*contribution):
+                    counts[stat_key] = counts.get(stat_key, 0) + 1
+        return counts
+
+    def rebuild_stats(self, verify_only=False):
+        # Ricalcola i contatori dallo storico. Con verify_only non scrive nulla
+        # e restituisce le differenze {(kind, key, sub): (salvato, ricalcolato)}
+        with self._write() as cur:
+            counts = self._compute_stats()
+            stored = {(k, key, sub): c for k, key, sub, c in cur.execute("SELECT kind, key, sub, count FROM stats")}
+            diff = {
+                stat_key: (stored.get(stat_key, 0), counts.get(stat_key, 0))
+                for stat_key in stored.keys() | counts.keys()
+                if stored.get(stat_key, 0) != counts.get(stat_key, 0)
+            }
+            if not verify_only:
+                cur.execute("DELETE FROM stats")
+                cur.executemany(
+                    "INSERT INTO stats (kind, key, sub, count) VALUES (?, ?, ?, ?)",
+                    [(*stat_key, c) for stat_key, c in counts.items()],
+                )
+                cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('stats', 1)")
+        return diff
+
+    # ---------------------------- SCRITTURA ----------------------------
+    def _upsert_event(self, cur, data, desc, roles):
+        # I contatori del vecchio layout si tolgono e quelli nuovi si aggiungono,
+        # così anche un cambio di aereo su un ruolo resta coerente
+        old = cur.execute("SELECT roles FROM events WHERE data = ?", (data,)).fetchone()
+        if old:
+            self._apply_event_stats(cur, json.loads(old[0]), -1)
+        self._apply_event_stats(cur, roles, +1)
+        seq = self._next_seq(cur)
+        cur.execute(
+            "INSERT INTO events (data, desc, roles, version, seq) VALUES (?, ?, ?, 1, ?) "
+            "ON CONFLICT(data) DO UPDATE SET desc = excluded.desc, roles = excluded.roles, "
+            "version = version + 1, seq = excluded.seq",
+            (data, desc, json.dumps(roles), seq),
+        )
+
+    def create_event(self, data, desc, roles, guild_id=None, exclusive=False):
+        # exclusive: un evento con la stessa data non viene sovrascritto (ne
+        # perderebbe prenotazioni e messaggio) ma solleva EventExists
+        with self._write() as cur:
+            if exclusive and cur.execute("SELECT 1 FROM events WHERE data = ?", (data,)).fetchone():
+                raise EventExists(data)
+            self._upsert_event(cur, data, desc, roles)
+            if guild_id is not None:
+                cur.execute("UPDATE events SET guild_id = ? WHERE data = ?", (guild_id, data))
+            row = cur.execute(f"SELECT {_COLUMNS} FROM events WHERE data = ?", (data,)).fetchone()
+        return _row_to_event(row)
+
+    def put_events(self, events, guild_id=None, channel_id=None):
+        # Un'unica transazione per tutto il lotto. Con guild_id gli eventi
+        # appartengono a quella guild: uno già di un'altra guild solleva
+        # EventExists e annulla il lotto; channel_id li mette in coda per la
+        # pubblicazione (vedi unpublished_events) se non hanno già un messaggio.
+        with self._write() as cur:
+            for event in events:
+                if guild_id is not None:
+                    owner = cur.execute("SELECT guild_id FROM events WHERE data = ?", (event["data"],)).fetchone()
+                    if owner and owner[0] is not None and owner[0] != guild_id:
+                        raise EventExists(event["data"])
+                self._upsert_event(cur, event["data"], event.get("desc", ""), event["roles"])
+                if guild_id is not None:
+                    cur.execute(
+                        "UPDATE events SET guild_id = ?, channel_id = COALESCE(channel_id, ?) WHERE data = ?",
+                        (guild_id, channel_id, event["data"]),
+                    )
+        return len(events)
+
+    def set_message(self, data, guild_id, channel_id, message_id):
+        # La posizione del messaggio non cambia il roster: niente nuova versione,
+        # ma un nuovo seq perché i backup la includano
+        with self._write() as cur:
+            seq = self._next_seq(cur)
+            cur.execute(
+                "UPDATE events SET guild_id = ?, channel_id = ?, message_id = ?, seq = ? WHERE data = ?",
+                (guild_id, channel_id, message_id, seq, data),
+            )
+
+    def clear_message(self, data):
+        # La guild resta: l'evento continua ad appartenerle anche senza messaggio
+        with self._write() as cur:
+            seq = self._next_seq(cur)
+            cur.execute(
+                "UPDATE events SET channel_id = NULL, message_id = NULL, seq = ? WHERE data = ?",
+                (seq, data),
+            )
+
+    def toggle_booking(self, data, role, user):
+        # Restituisce (esito, evento) con esito tra:
+        # "prenotato", "rimosso", "pieno", "occupato" (già in un altro ruolo),
+        # "sconosciuto" (evento o ruolo inesistente)
+        with self._write() as cur:
+            row = cur.execute(f"SELECT {_COLUMNS} FROM events WHERE data = ?", (data,)).fetchone()
+            event = _row_to_event(row)
+            if event is None or role not in event["roles"]:
+                return "sconosciuto", event
+
+            roles = event["roles"]
+            already_in_role = None
+            for r, info in roles.items():
+                if user in info["users"]:
+                    already_in_role = r
+                    break
+
+            role_info = roles[role]
+            if already_in_role and already_in_role != role:
+                return "occupato", event
+            if user in role_info["users"]:
+                role_info["users"].remove(user)
+                esito = "rimosso"
+                self._bump_stats(cur, user, role, role_info["plane"], -1)
+            elif len(role_info["users"]) >= role_info["slots"]:
+                return "pieno", event
+            else:
+                role_info["users"].append(user)
+                esito = "prenotato"
+                self._bump_stats(cur, user, role, role_info["plane"], +1)
+
+            seq = self._next_seq(cur)
+            cur.execute(
+                "UPDATE events SET roles = ?, version = version + 1, seq = ? WHERE id = ?",
+                (json.dumps(roles), seq, event["id"]),
+            )
+            event["version"] += 1
+            event["seq"] = seq
+        return esito, event
+
+    def restore_snapshot(self, events, seq, series=()):
+        # Sostituisce l'intero contenuto con quello di uno snapshot
+        with self._write() as cur:
+            cur.execute("DELETE FROM series")
+            cur.executemany(
+                f"INSERT INTO series ({_SERIES_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(s["id"], s["nome"], s["desc"], s["weekday"], s["ora"], s["ogni"], s["inizio"], s["fine"],
+                  json.dumps(s["roles"]), s["guild_id"], s["channel_id"], s["ultima"]) for s in series],
+            )
+            cur.execute("DELETE FROM events")
+            cur.executemany(
+                f"INSERT INTO events ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(e["id"], e["data"], e["desc"], json.dumps(e["roles"]), e["version"], e["seq"],
+                  e.get("guild_id"), e.get("channel_id"), e.get("message_id"), e.get("series_id"))
+                 for e in events],
+            )
+            cur.execute(
+                "INSERT INTO meta (key, value) VALUES ('seq', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (seq,),
+            )
+        self.rebuild_stats()
+
+    # ---------------------------- SERIE RICORRENTI ----------------------------
+    # Una serie è una sola riga (giorno, ora, cadenza, layout dei ruoli).
+    # Le occorrenze diventano eventi solo quando entrano nella finestra di
+    # prenotazione: le date future non occupano spazio nello store.
+    def create_series(self, nome, desc, weekday, ora, ogni, roles, guild_id, channel_id, inizio, fine=None):
+        with self._write() as cur:
+            self._next_seq(cur)
+            cur.execute(
+                "INSERT INTO series (nome, desc, weekday, ora, ogni, inizio, fine, roles, guild_id, channel_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (nome, desc, weekday, ora, ogni, inizio, fine, json.dumps(roles), guild_id, channel_id),
+            )
+
+    def series_list(self, guild_id):
+        rows = self._conn().execute(
+            f"SELECT {_SERIES_COLUMNS} FROM series WHERE guild_id = ? ORDER BY nome", (guild_id,)
+        ).fetchall()
+        return [_row_to_series(row) for row in rows]
+
+    def delete_series(self, guild_id, nome):
+        # Gli eventi già generati restano: si fermano solo le occorrenze future
+        with self._write() as cur:
+            self._next_seq(cur)
+            cur.execute("DELETE FROM series WHERE guild_id = ? AND nome = ?", (guild_id, nome))
+            return cur.rowcount > 0
+
+    def materialize_due(self, now, windows):
+        # windows: {guild_id: giorni della finestra di prenotazione}, solo per
+        # le guild di questo processo. Restituisce (creati, conflitti): le
+        # coppie (serie, evento) create e le coppie (serie, chiave) già
+        # occupate da un evento che non appartiene alla serie. Le occorrenze
+        # già passate vengono saltate senza crearle. Gli eventi nascono con
+        # guild e canale della serie ma senza messaggio: vedi unpublished_events.
+        today = now.date()
+        created = []
+        clashes = []
+        with self._write() as cur:
+            rows = cur.execute(f"SELECT {_SERIES_COLUMNS} FROM series ORDER BY id").fetchall()
+            for series in map(_row_to_series, rows):
+                window = windows.get(series["guild_id"])
+                if window is None:
+                    continue
+                horizon = today + timedelta(days=window)
+                end = date.fromisoformat(series["fine"]) if series["fine"] else None
+                last = date.fromisoformat(series["ultima"]) if series["ultima"] else None
+                yesterday = today - timedelta(days=1)
+                day = next_occurrence(series, max(last, yesterday) if last else yesterday)
+                while day <= horizon and (end is None or day <= end):
+                    data = occurrence_key(series, day)
+                    owner = cur.execute("SELECT series_id FROM events WHERE data = ?", (data,)).fetchone()
+                    if owner is None:
+                        self._upsert_event(cur, data, series["desc"], series["roles"])
+                        cur.execute(
+                            "UPDATE events SET guild_id = ?, channel_id = ?, series_id = ? WHERE data = ?",
+                            (series["guild_id"], series["channel_id"], series["id"], data),
+                        )
+                        row = cur.execute(f"SELECT {_COLUMNS} FROM events WHERE data = ?", (data,)).fetchone()
+                        created.append((series, _row_to_event(row)))
+                    elif owner[0] != series["id"]:
+                        clashes.append((series, data))
+                    last = day
+                    day = next_occurrence(series, day)
+                if last and last.isoformat() != series["ultima"]:
+                    cur.execute("UPDATE series SET ultima = ? WHERE id = ?", (last.isoformat(), series["id"]))
+        return created, clashes
+
+    def unpublished_events(self, day, guild_ids):
+        # Eventi (da `day` in poi) con un canale di destinazione ma ancora
+        # senza messaggio: occorrenze delle serie ed eventi importati. Canale
+        # mancante o invio fallito si ritentano al batch successivo.
+        # clear_message azzera anche il canale, quindi un messaggio
+        # cancellato a mano non viene ripubblicato.
+        rows = self._conn().execute(
+            f"SELECT {_COLUMNS} FROM events WHERE message_id IS NULL "
+            "AND channel_id IS NOT NULL AND data >= ? ORDER BY id", (day,)
+        ).fetchall()
+        return [event for event in map(_row_to_event, rows) if event["guild_id"] in guild_ids]
+
+    # ---------------------------- MIGRAZIONE ----------------------------
+    def import_legacy(self, path=LEGACY_JSON):
+        # Importa il vecchio prenotazioni.json solo se il database è vuoto.
+        # Le chiavi con valori non-dict sono residui delle versioni precedenti.
+        if not os.path.exists(path):
+            return 0
+        if self._conn().execute("SELECT 1 FROM events LIMIT 1").fetchone():
+            return 0
+        with open(path, "r") as f:
+            legacy = json.load(f)
+        imported = 0
+        with self._write() as cur:
+            for data, roles in legacy.items():
+                if not isinstance(roles, dict) or not all(isinstance(v, dict) for v in roles.values()):
+                    continue
+                seq = self._next_seq(cur)
+                cur.execute(
+                    "INSERT OR IGNORE INTO events (data, desc, roles, version, seq) VALUES (?, '', ?, 1, ?)",
+                    (data, json.dumps(roles), seq),
+                )
+                imported += 1
+        self.rebuild_stats()
+        return imported
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ricostruisce le statistiche di partecipazione dallo storico")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--verifica", action="store_true", help="confronta soltanto, senza scrivere")
+    args = parser.parse_args()
+
+    diff = BookingStore(args.db).rebuild_stats(verify_only=args.verifica)
+    for (kind, key, sub), (stored, computed) in sorted(diff.items()):
+        print(f"{kind} {key} {sub}: salvato {stored}, ricalcolato {computed}")
+    if args.verifica:
+        print("✅ Statistiche coerenti" if not diff else f"❌ {len(diff)} contatori diversi")
+        raise SystemExit(1 if diff else 0)
+    print(f"✅ Statistiche ricostruite ({len(diff)} contatori corretti)")
+
+
+if __name__ == "__main__":
+    main()